@@ -1,28 +1,52 @@
-from osfexport.exporter import (
-    call_api, is_public,
-    extract_project_id,
-    MockAPIResponse, get_nodes,
-    paginate_json_result
-)
-
-from osfexport.cli import (
-    prompt_pat, cli
-)
-
-from osfexport.formatter import (
-    write_pdf
-)
-
-__all__ = [
-    'call_api',
-    'get_nodes',
-    'write_pdf',
-    'is_public',
-    'extract_project_id',
-    'MockAPIResponse',
-    'get_nodes',
-    'paginate_json_result',
-    'extract_project_id',
-    'prompt_pat',
-    'cli'
-]
+import importlib
+import sys
+import types
+
+# Public names and the modules they come from.
+# Modules are only imported on first use, so using the exporter alone
+# doesn't load the PDF and CLI libraries (and vice versa).
+_LAZY_IMPORTS = {
+    'call_api': 'osfexport.exporter',
+    'is_public': 'osfexport.exporter',
+    'extract_project_id': 'osfexport.exporter',
+    'MockAPIResponse': 'osfexport.exporter',
+    'get_nodes': 'osfexport.exporter',
+    'paginate_json_result': 'osfexport.exporter',
+    'prompt_pat': 'osfexport.cli',
+    'cli': 'osfexport.cli',
+    'write_pdf': 'osfexport.formatter',
+}
+_SUBMODULES = ('exporter', 'formatter')
+
+__all__ = list(_LAZY_IMPORTS)
+
+
+def __getattr__(name):
+    if name in _LAZY_IMPORTS:
+        module = importlib.import_module(_LAZY_IMPORTS[name])
+        value = getattr(module, name)
+        globals()[name] = value  # Skip this lookup on later accesses
+        return value
+    if name in _SUBMODULES:
+        return importlib.import_module(f'{__name__}.{name}')
+    raise AttributeError(f'module {__name__!r} has no attribute {name!r}')
+
+
+class _Package(types.ModuleType):
+    """Package module that keeps `cli` bound to the click command.
+
+    Importing osfexport.cli sets the package's `cli` attribute to the
+    submodule, which would hide the command of the same name.
+    """
+
+    def __setattr__(self, name, value):
+        if name == 'cli' and isinstance(value, types.ModuleType):
+            value = value.cli
+        super().__setattr__(name, value)
+
+
+def __dir__():
+    return sorted(list(globals()) + __all__ + list(_SUBMODULES))
+
+
+sys.modules[__name__].__class__ = _Package
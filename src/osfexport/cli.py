@@ -66,6 +66,12 @@ def prompt_pat(project_id='', usetest=False):
               Otherwise, {API_HOST_PROD} is the default hostname.""")
 @click.option('--folder', type=str, default='',
               help='The folder path to export PDFs to.')
+@click.option('--cache-dir', type=str, default=exporter.RESPONSE_CACHE_DIR,
+              help="""A folder to cache API responses in between exports.
+              Data the API says is unchanged isn't downloaded again.
+              Defaults to the OSFEXPORT_CACHE_DIR environment variable.""")
+@click.option('--no-cache', is_flag=True, default=False,
+              help='If enabled, download all data from the API without using a cache.')
 @click.option('--url', type=str, default='',
               help="""A link to one project you want to export.
               The project ID should be at the end.
@@ -73,11 +79,26 @@ def prompt_pat(project_id='', usetest=False):
               For example: https://osf.io/dry9j/
 
               Leave blank to export all projects you have access to.""")
-def export_projects(folder, pat='', dryrun=False, url='', usetest=False):
+def export_projects(
+        folder, pat='', dryrun=False, url='', usetest=False,
+        cache_dir='', no_cache=False):
     """Pull and export OSF projects to a PDF file.
     You can export all projects you have access to, or one specific one
     with the --url option."""
 
+    # Only use the cache settings for this export, so later callers in
+    # the same process (e.g. tests or scripts) aren't affected
+    default_cache_dir = exporter.RESPONSE_CACHE_DIR
+    exporter.RESPONSE_CACHE_DIR = '' if no_cache else cache_dir
+    try:
+        _export_projects(folder, pat, dryrun, url, usetest)
+    finally:
+        exporter.RESPONSE_CACHE_DIR = default_cache_dir
+
+
+def _export_projects(folder, pat, dryrun, url, usetest):
+    """Export projects to PDFs, reporting any API errors to the user."""
+
     project_id = ''
     if url:
         project_id = exporter.extract_project_id(url)
@@ -95,11 +116,11 @@ def export_projects(folder, pat='', dryrun=False, url='', usetest=False):
             pat, dryrun=dryrun, project_id=project_id, usetest=usetest
         )
         click.echo(f'Found {len(root_nodes)} projects.')
-        for idx in root_nodes:
+        click.echo('Exporting projects...')
+        paths = formatter.write_pdfs(projects, root_nodes, folder)
+        for idx, path in zip(root_nodes, paths):
             title = projects[idx]['metadata']['title']
-            click.echo(f'Exporting project {title}...')
-            pdf, path = formatter.write_pdf(projects, idx, folder)
-            click.echo(f'Project exported to {path}')
+            click.echo(f'Project {title} exported to {path}')
     except (HTTPError, URLError) as e:
         click.echo("Exporting failed as an error occurred: ")
         if isinstance(e, HTTPError):
@@ -1,14 +1,27 @@
 from collections import deque
-import json
+from concurrent.futures import ThreadPoolExecutor
+import functools
+import hashlib
+import io
 import os
+import threading
 import datetime
 from urllib.error import HTTPError, URLError
+import urllib.parse
 import urllib.request as webhelper
+from urllib.response import addinfourl
 import importlib.metadata
 import time
 import random
+import tempfile
 import logging
 
+try:
+    # orjson is optional, but parses API responses several times faster
+    from orjson import loads as json_loads
+except ImportError:
+    from json import loads as json_loads
+
 logging.basicConfig(
     level=logging.WARNING, format='%(message)s'
 )
@@ -21,6 +34,24 @@ STUBS_DIR = os.path.join(
     os.path.dirname(__file__), 'stubs'
 )
 
+# Folder to cache API responses in between exports. Cached responses are
+# only reused if the API confirms they are unchanged via their ETag.
+# Leave empty to turn caching off.
+RESPONSE_CACHE_DIR = os.getenv('OSFEXPORT_CACHE_DIR', '')
+
+# Max number of API calls to have in flight at once.
+# Kept small so that we don't trigger the API's rate limits.
+API_WORKERS = 4
+# Shared by all threads making API calls, as lookups for a project can
+# start threads of their own (e.g. to explore its file tree)
+_API_SLOTS = threading.BoundedSemaphore(API_WORKERS)
+
+# Nice representations of project categories, if needed
+CATEGORY_STRS = {
+    '': 'Uncategorized',
+    'methods and measures': 'Methods and Measures'
+}
+
 # Reduce response size by applying filters on fields
 URL_FILTERS = {
     'identifiers': {
@@ -110,7 +141,7 @@ class MockAPIResponse:
     }
 
     @staticmethod
-    def read(field):
+    def read(field, shared=False):
         """Get mock response for a field.
 
         Parameters
@@ -119,21 +150,40 @@ class MockAPIResponse:
                 ID associated to a JSON or Markdown mock file.
                 Available fields to mock are listed in class-level
                 JSON_FILES and MARKDOWN_FILES attributes.
+            shared: bool
+                If True, return JSON parsed once and shared between calls.
+                Only use this if the result won't be modified.
+                Otherwise a fresh copy is parsed for each call.
 
         Returns
         ------------
             Parsed JSON dictionary or Markdown."""
 
-        if field in MockAPIResponse.JSON_FILES.keys():
-            with open(MockAPIResponse.JSON_FILES[field], 'r') as file:
-                return json.load(file)
-        elif field in MockAPIResponse.MARKDOWN_FILES.keys():
-            with open(MockAPIResponse.MARKDOWN_FILES[field], 'r') as file:
-                return file.read()
+        if field in MockAPIResponse.JSON_FILES:
+            if shared:
+                return _parse_stub(MockAPIResponse.JSON_FILES[field])
+            return json_loads(_read_stub(MockAPIResponse.JSON_FILES[field]))
+        elif field in MockAPIResponse.MARKDOWN_FILES:
+            return _read_stub(MockAPIResponse.MARKDOWN_FILES[field])
         else:
             return {'data': {}}
 
 
+@functools.lru_cache(maxsize=None)
+def _read_stub(path):
+    """Read a stub file's contents, only opening each file once."""
+
+    with open(path, 'r') as file:
+        return file.read()
+
+
+@functools.lru_cache(maxsize=None)
+def _parse_stub(path):
+    """Parse a JSON stub file, only parsing each file once."""
+
+    return json_loads(_read_stub(path))
+
+
 def extract_project_id(url):
     """Extract project ID from a given OSF project URL.
 
@@ -211,9 +261,12 @@ def is_public(url):
     """
 
     try:
-        result = call_api(
-            url, pat='', method='GET'
-        ).status
+        # Only the status code is needed, so skip downloading the body
+        response = call_api(
+            url, pat='', method='HEAD'
+        )
+        result = response.status
+        response.close()
     except (HTTPError, URLError) as e:
         # Don't raise error if we get a HTTP error with certain codes
         valid_error_codes = [401, 403]
@@ -225,8 +278,15 @@ def is_public(url):
     return is_public
 
 
+@functools.lru_cache(maxsize=None)
+def _user_agent():
+    """Get the User-Agent header, only looking up the installed version once."""
+
+    return f'osfexport/{importlib.metadata.version("osfexport")} (Python)'
+
+
 def call_api(
-        url, pat, method='GET', per_page=100, filters={}, is_json=True,
+        url, pat, method='GET', per_page=100, filters=None, is_json=True,
         usetest=False, max_tries=5):
     """Call OSF v2 API methods.
 
@@ -268,18 +328,22 @@ def call_api(
             Response to the request from the API.
     """
     if (filters or per_page) and method == 'GET':
-        query_string = '&'.join([f'filter[{key}]={value}'
-                                 for key, value in filters.items()
-                                 if not isinstance(value, dict)])
+        params = {
+            f'filter[{key}]': value for key, value in (filters or {}).items()
+            if not isinstance(value, dict)
+        }
         if per_page:
-            query_string += f'&page[size]={per_page}'
-        url = f'{url}?{query_string}'
+            params['page[size]'] = per_page
+        # Keep brackets readable as the API docs use them unescaped
+        query_string = urllib.parse.urlencode(params, safe='[]')
+        # Add to any query parameters already in the URL
+        separator = '&' if '?' in url else '?'
+        url = f'{url}{separator}{query_string}'
 
     request = webhelper.Request(url, method=method)
     request.add_header('Authorization', f'Bearer {pat}')
 
-    version = importlib.metadata.version("osfexport")
-    request.add_header('User-Agent', f'osfexport/{version} (Python)')
+    request.add_header('User-Agent', _user_agent())
 
     # Pin API version so that JSON has correct format
     API_VERSION = '2.20'
@@ -289,18 +353,34 @@ def call_api(
             f'application/vnd.api+json;version={API_VERSION}'
         )
 
+    # Ask the API to skip sending data we already have cached
+    cache_path = None
+    cached = None
+    if RESPONSE_CACHE_DIR and method == 'GET':
+        key = hashlib.sha256(f'{pat}\n{is_json}\n{url}'.encode('utf-8')).hexdigest()
+        cache_path = os.path.join(RESPONSE_CACHE_DIR, key)
+        cached = _read_cached_response(cache_path)
+        if cached:
+            request.add_header('If-None-Match', cached[0])
+
     if max_tries > 7:
         max_tries = 7  # Cap retries to reduce requests sent and max delay time
 
     # Retry requests if we get 429 errors
     try_count = 0
     result = None
+    from_cache = False
     while try_count < max_tries and result is None:
         try:
-            result = webhelper.urlopen(request)
+            with _API_SLOTS:
+                result = webhelper.urlopen(request)
         except HTTPError as e:
             # Other error codes tell us directly something is wrong
-            if e.code == 429:
+            if e.code == 304 and cached:
+                result = addinfourl(io.BytesIO(cached[1]), e.headers, url, code=200)
+                from_cache = True
+                e.close()  # Only its headers are needed, so free the connection
+            elif e.code == 429:
                 if not usetest:
                     # Wait longer between requests to give API more recovery time
                     # Wait random periods to avoid hammering requests all at once
@@ -319,9 +399,44 @@ def call_api(
             hdrs=request.headers,
             fp=None
         )
+
+    # Save responses that can be revalidated for use in later exports
+    if cache_path and not from_cache and result.status == 200:
+        etag = result.headers.get('ETag')
+        if etag:
+            body = result.read()
+            _write_cached_response(cache_path, etag, body)
+            result = addinfourl(io.BytesIO(body), result.headers, url, code=200)
     return result
 
 
+def _read_cached_response(path):
+    """Get the (ETag, body) pair saved for a response, or None if not cached."""
+
+    try:
+        with open(path, 'rb') as file:
+            etag, _, body = file.read().partition(b'\n')
+    except OSError:
+        return None
+    return etag.decode('utf-8'), body
+
+
+def _write_cached_response(path, etag, body):
+    """Save a response's ETag and body to the response cache."""
+
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    # Write to a temporary file first so other threads (or exports running
+    # at the same time) never read half a file
+    fd, temp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix='.tmp')
+    try:
+        with os.fdopen(fd, 'wb') as file:
+            file.write(etag.encode('utf-8') + b'\n' + body)
+        os.replace(temp_path, path)
+    except BaseException:
+        os.remove(temp_path)
+        raise
+
+
 def paginate_json_result(start, action, fail_on_first=True, **kwargs):
     """Loop through paginated JSON responses and perform an action on each.
 
@@ -364,116 +479,181 @@ def paginate_json_result(start, action, fail_on_first=True, **kwargs):
     is_json = kwargs.pop('is_json', True)
     pat = kwargs.get('pat', '')
     dryrun = kwargs.get('dryrun', False)
-    while not is_last_page:
-        try:
-            if not dryrun:
-                curr_page = call_api(
-                    next_link, pat, per_page=per_page, filters=filters,
-                    is_json=is_json)
-                # Catch error if call_api is replaced with mock in tests
-                try:
-                    curr_page = curr_page.read()
-                    if is_json:
-                        curr_page = json.loads(curr_page)
-                except AttributeError:
-                    pass
-            else:
-                curr_page = MockAPIResponse.read(next_link)
-            results.append(action(curr_page, **kwargs))
-        except HTTPError as e:
-            if fail_on_first and is_first_item or e.code == 429:
-                raise e
-            else:
-                logging.warning("Warning: Couldn't parse JSON page, skipping to next page...")
-        # Stop if no next link found
-        try:
-            next_link = curr_page['links']['next']
-            is_last_page = not next_link
-        except (KeyError, UnboundLocalError):
-            is_last_page = True
+    page_args = (pat, per_page, filters, is_json)
+    next_page = None  # Next page being downloaded in the background
+    with ThreadPoolExecutor(max_workers=1) as executor:
+        while not is_last_page:
+            try:
+                if not dryrun:
+                    if next_page is None:
+                        next_page = executor.submit(_read_page, next_link, *page_args)
+                    page, next_page = next_page, None
+                    curr_page = page.result()
+
+                    # Start downloading the next page while this one is used
+                    try:
+                        link = curr_page['links']['next']
+                    except (KeyError, TypeError):
+                        link = None
+                    if link:
+                        next_page = executor.submit(_read_page, link, *page_args)
+                else:
+                    curr_page = MockAPIResponse.read(next_link)
+                results.append(action(curr_page, **kwargs))
+            except HTTPError as e:
+                if fail_on_first and is_first_item or e.code == 429:
+                    raise e
+                else:
+                    logging.warning("Warning: Couldn't parse JSON page, skipping to next page...")
+            # Stop if no next link found
+            try:
+                next_link = curr_page['links']['next']
+                is_last_page = not next_link
+            except (KeyError, UnboundLocalError):
+                is_last_page = True
     return results
 
 
-def explore_file_tree(curr_link, pat, dryrun=True):
-    """Explore and get names of files stored in OSF.
+def _read_page(link, pat, per_page, filters, is_json):
+    """Download and parse one page of API results."""
+
+    curr_page = call_api(
+        link, pat, per_page=per_page, filters=filters, is_json=is_json)
+    # Catch error if call_api is replaced with mock in tests
+    try:
+        curr_page = curr_page.read()
+        if is_json:
+            curr_page = json_loads(curr_page)
+    except AttributeError:
+        pass
+    return curr_page
+
+
+def _file_tree_pages(link, pat, filters, dryrun, mock_suffix):
+    """Yield each page of files or folders listed for a folder.
 
     Parameters
     ----------
-    curr_link: string
-        URL/name to use to get real/mock files and folders.
-    pat: string
+    link: str
+        URL/name to use to get the first real/mock page.
+    pat: str
         Personal Access Token to authorise a user.
+    filters: dict
+        Filters to apply to API calls, e.g. to only list folders.
     dryrun: bool
         Flag to indicate whether to use mock JSON files or real API calls.
+    mock_suffix: str
+        Suffix to add to page names when getting mock JSON files.
+    """
 
-    Returns
-    ----------
-        files_found: list[str]
-            List of file paths found in the project."""
-
-    FILE_FILTER = {
-        'kind': 'file'
-    }
-    FOLDER_FILTER = {
-        'kind': 'folder'
-    }
-    per_page = 100
-
-    files_found = []
-
-    is_last_page_folders = False
-    while not is_last_page_folders:
+    while link:
         if dryrun:
-            folders = MockAPIResponse.read(f"{curr_link}_folder")
+            page = MockAPIResponse.read(f"{link}{mock_suffix}", shared=True)
         else:
-            folders = json.loads(
+            page = json_loads(
                 call_api(
-                    curr_link, pat,
-                    per_page=per_page, filters=FOLDER_FILTER
+                    link, pat, per_page=100, filters=filters
                 ).read()
             )
+        yield page
+        link = page['links']['next']
+
 
-        # Find deepest subfolders first to avoid missing files
+def _list_subfolders(link, pat, dryrun):
+    """Get links to the subfolders directly inside a folder."""
+
+    FOLDER_FILTER = {
+        'kind': 'folder'
+    }
+    subfolders = []
+    for folders in _file_tree_pages(link, pat, FOLDER_FILTER, dryrun, '_folder'):
         try:
             for folder in folders['data']:
                 links = folder['relationships']['files']['links']
-                link = links['related']['href']
-                files_found += explore_file_tree(link, pat, dryrun=dryrun)
+                subfolders.append(links['related']['href'])
         except KeyError:
             pass
+    return subfolders
 
-        # For each folder, loop through pages for its files
-        is_last_page_files = False
-        while not is_last_page_files:
-            if dryrun:
-                files = MockAPIResponse.read(f"{curr_link}_files")
-            else:
-                files = json.loads(
-                    call_api(
-                        curr_link, pat,
-                        per_page=per_page, filters=FILE_FILTER
-                    ).read()
+
+def _list_files(link, pat, dryrun):
+    """Get path, size in MB and download link of files directly inside a folder."""
+
+    FILE_FILTER = {
+        'kind': 'file'
+    }
+    BYTES_PER_MB = 1024 ** 2
+    files_found = []
+    for files in _file_tree_pages(link, pat, FILE_FILTER, dryrun, '_files'):
+        try:
+            # extend keeps files added before any malformed entry
+            files_found.extend(
+                (
+                    file['attributes']['materialized_path'],
+                    str(round(file['attributes']['size'] / BYTES_PER_MB, 2)),
+                    file['links']['download']
                 )
-            try:
-                for file in files['data']:
-                    size = file['attributes']['size']
-                    size_mb = size / (1024 ** 2)  # Convert bytes to MB
-                    data = (
-                        file['attributes']['materialized_path'],
-                        str(round(size_mb, 2)),
-                        file['links']['download']
-                    )
-                    files_found.append(data)
-            except KeyError:
-                pass
-            curr_link = files['links']['next']
-            if curr_link is None:
-                is_last_page_files = True
+                for file in files['data']
+            )
+        except KeyError:
+            pass
+    return files_found
+
+
+def explore_file_tree(curr_link, pat, dryrun=True):
+    """Explore and get names of files stored in OSF.
+
+    Parameters
+    ----------
+    curr_link: string
+        URL/name to use to get real/mock files and folders.
+    pat: string
+        Personal Access Token to authorise a user.
+    dryrun: bool
+        Flag to indicate whether to use mock JSON files or real API calls.
 
-        curr_link = folders['links']['next']
-        if curr_link is None:
-            is_last_page_folders = True
+    Returns
+    ----------
+        files_found: list[str]
+            List of file paths found in the project."""
 
+    # Explore one level of folders at a time. Folders on the same level
+    # don't depend on each other, so list all their contents at once.
+    # Folders are numbered in the order they are found
+    links = [curr_link]
+    files_in = []  # Files directly inside each folder
+    subfolders_of = []  # Numbers of the subfolders directly inside each folder
+    level = [0]
+    with ThreadPoolExecutor(max_workers=API_WORKERS) as executor:
+        while level:
+            subfolder_jobs = [
+                executor.submit(_list_subfolders, links[idx], pat, dryrun)
+                for idx in level
+            ]
+            file_jobs = [
+                executor.submit(_list_files, links[idx], pat, dryrun)
+                for idx in level
+            ]
+            level = []
+            for subfolder_job, file_job in zip(subfolder_jobs, file_jobs):
+                files_in.append(file_job.result())
+                subfolders = subfolder_job.result()
+                first = len(links)
+                subfolders_of.append(range(first, first + len(subfolders)))
+                level.extend(subfolders_of[-1])
+                links.extend(subfolders)
+
+    # List files in each folder's subfolders before its own files,
+    # going through subfolders in the order they were listed
+    files_found = []
+    stack = [(0, False)]
+    while stack:
+        idx, subfolders_done = stack.pop()
+        if subfolders_done:
+            files_found.extend(files_in[idx])
+        else:
+            stack.append((idx, True))
+            stack.extend((sub_idx, False) for sub_idx in reversed(subfolders_of[idx]))
     return files_found
 
 
@@ -496,9 +676,9 @@ def explore_wikis(link, pat, dryrun=True):
     wiki_content = {}
     is_last_page = False
     if dryrun:
-        wikis = MockAPIResponse.read('wikis')
+        wikis = MockAPIResponse.read('wikis', shared=True)
     else:
-        wikis = json.loads(
+        wikis = json_loads(
             call_api(link, pat).read()
         )
 
@@ -520,9 +700,9 @@ def explore_wikis(link, pat, dryrun=True):
             is_last_page = True
         else:
             if dryrun:
-                wikis = MockAPIResponse.read(link)
+                wikis = MockAPIResponse.read(link, shared=True)
             else:
-                wikis = json.loads(
+                wikis = json_loads(
                     call_api(link, pat).read()
                 )
 
@@ -641,21 +821,12 @@ def get_project_data(nodes, **kwargs):
             'id': lambda project, **kwargs: project['id'],
             'url': lambda project, **kwargs: project['links']['html'],
             'description': lambda project, **kwargs: project['attributes']['description'],
-            # timestamps are rendered as yyyy-mm-dd hour:minute UTC (24hr)
-            'date_created': lambda project, **kwargs: datetime.datetime.fromisoformat(
-                    project['attributes']['date_created']
-                ).astimezone(
-                    datetime.timezone.utc
-                ).strftime(
-                    '%Y-%m-%d %H:%M %Z'
-                ),
-            'date_modified': lambda project, **kwargs: datetime.datetime.fromisoformat(
-                    project['attributes']['date_modified']
-                ).astimezone(
-                    datetime.timezone.utc
-                ).strftime(
-                    '%Y-%m-%d %H:%M %Z'
-                ),
+            'date_created': lambda project, **kwargs: format_date(
+                project['attributes']['date_created']
+            ),
+            'date_modified': lambda project, **kwargs: format_date(
+                project['attributes']['date_modified']
+            ),
             'public': lambda project, **kwargs: project['attributes']['public'],
             'category': get_category,
             'tags': get_tags,
@@ -670,151 +841,200 @@ def get_project_data(nodes, **kwargs):
         'contributors': get_contributors
     }
 
-    for idx, project in enumerate(nodes['data']):
-        try:
-            if project['id'] in added_node_ids:
-                continue
-            else:
-                added_node_ids.add(project['id'])
+    # Work through nodes in order, queueing children as they're found
+    queue = deque(nodes['data'])
+    idx = -1  # Position of current node in the order nodes are processed
+    with ThreadPoolExecutor(max_workers=API_WORKERS) as executor:
+        while queue:
+            project = queue.popleft()
+            idx += 1
+            try:
+                if project['id'] in added_node_ids:
+                    continue
+                else:
+                    added_node_ids.add(project['id'])
 
-            project_data = {
-                'metadata': {}
-            }
-            for field in fields['metadata']:
-                project_data['metadata'][field] = fields['metadata'][field](
-                    project, dryrun=dryrun, key=field, pat=pat
-                )
-            project_data['contributors'] = fields['contributors'](
-                project, dryrun=dryrun, key='contributors', pat=pat
-            )
+                relations = project['relationships']
 
-            # TODO: split into function
-            # Resource type/lang/funding info share specific endpoint
-            # that isn't linked to in user nodes' responses
-            if dryrun:
-                metadata = MockAPIResponse.read('custom_metadata')
-            else:
-                metadata = json.loads(call_api(
-                    f"{api_host}/custom_item_metadata_records/{project['id']}/",
-                    pat
-                ).read())
-            metadata = metadata['data']['attributes']
-            resource_type = metadata['resource_type_general']
-            resource_lang = metadata['language']
-            project_data['metadata']['resource_type'] = resource_type
-            project_data['metadata']['resource_lang'] = resource_lang
-            for funder in metadata['funders']:
-                project_data['metadata']['funders'].append(funder)
-            # =========
-
-            relations = project['relationships']
-
-            # Get list of files in project
-            if dryrun:
-                link = 'root'
-                use_mocks = True
-            else:
-                link = relations['files']['links']['related']['href']
-                link += 'osfstorage/'  # ID for OSF Storage
-                use_mocks = False
-            project_data['files'] = explore_file_tree(link, pat, dryrun=use_mocks)
-
-            project_data['wikis'] = explore_wikis(
-                f'{api_host}/nodes/{project['id']}/wikis/',
-                pat=pat, dryrun=dryrun
-            )
+                # Get list of files in project
+                if dryrun:
+                    link = 'root'
+                    use_mocks = True
+                else:
+                    link = relations['files']['links']['related']['href']
+                    link += 'osfstorage/'  # ID for OSF Storage
+                    use_mocks = False
+
+                # None of these lookups depend on each other, so start them all
+                # at once and wait on the results in order
+                field_jobs = {
+                    field: executor.submit(
+                        func, project, dryrun=dryrun, key=field, pat=pat
+                    )
+                    for field, func in fields['metadata'].items()
+                }
+                contributors_job = executor.submit(
+                    fields['contributors'],
+                    project, dryrun=dryrun, key='contributors', pat=pat
+                )
+                metadata_job = executor.submit(
+                    get_custom_metadata, project, api_host, pat=pat, dryrun=dryrun
+                )
+                files_job = executor.submit(
+                    explore_file_tree, link, pat, dryrun=use_mocks
+                )
+                wikis_job = executor.submit(
+                    explore_wikis,
+                    f'{api_host}/nodes/{project['id']}/wikis/',
+                    pat=pat, dryrun=dryrun
+                )
 
-            # Check if parent info has been passed down to save effort
-            # If not then search for links to parent
-            try:
-                project_data['parent'] = project['parent']
-            except KeyError:
-                project_data['parent'] = None
+                project_data = {
+                    'metadata': {}
+                }
+                for field, job in field_jobs.items():
+                    project_data['metadata'][field] = job.result()
+                project_data['contributors'] = contributors_job.result()
+
+                metadata = metadata_job.result()
+                resource_type = metadata['resource_type_general']
+                resource_lang = metadata['language']
+                project_data['metadata']['resource_type'] = resource_type
+                project_data['metadata']['resource_lang'] = resource_lang
+                for funder in metadata['funders']:
+                    project_data['metadata']['funders'].append(funder)
+
+                project_data['files'] = files_job.result()
+                project_data['wikis'] = wikis_job.result()
+
+                # Check if parent info has been passed down to save effort
+                # If not then search for links to parent
+                try:
+                    project_data['parent'] = project['parent']
+                except KeyError:
+                    project_data['parent'] = None
+
+                    # In general, start nodes for PDFs have no parents
+                    parent_relation = relations['parent']
+                    if 'links' not in parent_relation:
+                        root_nodes.append(idx)
+                    elif project_data['parent'] is None:
+                        parent_link = parent_relation['links']['related']['href']
+                        try:
+                            if not dryrun:
+                                parent = json_loads(
+                                    call_api(
+                                        parent_link,
+                                        pat=pat,
+                                        is_json=True
+                                    ).read()
+                                )
+                            else:
+                                parent = MockAPIResponse.read(parent_link, shared=True)
+                            project_data['parent'] = (
+                                parent['data']['attributes']['title'],
+                                parent['data']['links']['html']
+                            )
+                        except (HTTPError, ValueError):
+                            logging.warning(
+                                f"Warning: Parent of {project_data['metadata']['title']} "
+                                "is private."
+                            )
+                            logging.warning(
+                                "Try to give a PAT beforehand using the --pat flag."
+                            )
 
-                # In general, start nodes for PDFs have no parents
-                if 'links' not in project['relationships']['parent']:
+                # Projects specified by ID to export also count as start nodes for PDFs
+                # This will be the first node in list of root nodes
+                if project_data['metadata']['id'] == project_id and 0 not in root_nodes:
                     root_nodes.append(idx)
-                elif project_data['parent'] is None:
-                    parent_link = project['relationships']['parent'][
-                        'links']['related']['href']
-                    try:
-                        if not dryrun:
-                            parent = json.loads(
-                                call_api(
-                                    parent_link,
-                                    pat=pat,
-                                    is_json=True
-                                ).read()
-                            )
-                        else:
-                            parent = MockAPIResponse.read(parent_link)
-                        project_data['parent'] = (
-                            parent['data']['attributes']['title'],
-                            parent['data']['links']['html']
-                        )
-                    except (HTTPError, ValueError):
-                        logging.warning(
-                            f"Warning: Parent of {project_data['metadata']['title']} is private."
-                        )
-                        logging.warning(
-                            "Try to give a PAT beforehand using the --pat flag."
-                        )
-
-            # Projects specified by ID to export also count as start nodes for PDFs
-            # This will be the first node in list of root nodes
-            if project_data['metadata']['id'] == project_id and 0 not in root_nodes:
-                root_nodes.append(idx)
-
-            def get_children(json_page, **kwargs):
-                children = []
-                for child in json_page['data']:
-                    child['parent'] = [
-                        project_data['metadata']['title'],
-                        project_data['metadata']['url']
-                    ]
-                    children.append(child['id'])
-                    nodes['data'].append(child)  # Add to list of nodes to search
-                return children
-
-            children_link = relations['children']['links']['related']['href']
-            children = list(paginate_json_result(
-                children_link, dryrun=dryrun, pat=pat, action=get_children
-            ))
-            newlist = [item for sublist in children for item in sublist]
-            project_data['children'] = newlist
-
-            projects.append(project_data)
-        except (HTTPError, KeyError) as e:
-            if isinstance(e, HTTPError):
-                if e.code == 429:
-                    raise e
-                logging.warning(f"Warning: A project failed to export: {e.code}")
-            else:
-                logging.warning("Warning: A project failed to export: Unexpected API response.")
-            logging.warning("Continuing with exporting other projects...")
+
+                def get_children(json_page, **kwargs):
+                    children = []
+                    for child in json_page['data']:
+                        child['parent'] = [
+                            project_data['metadata']['title'],
+                            project_data['metadata']['url']
+                        ]
+                        children.append(child['id'])
+                        queue.append(child)  # Add to list of nodes to search
+                    return children
+
+                children_link = relations['children']['links']['related']['href']
+                children = list(paginate_json_result(
+                    children_link, dryrun=dryrun, pat=pat, action=get_children
+                ))
+                newlist = [item for sublist in children for item in sublist]
+                project_data['children'] = newlist
+
+                projects.append(project_data)
+            except (HTTPError, KeyError) as e:
+                if isinstance(e, HTTPError):
+                    if e.code == 429:
+                        raise e
+                    logging.warning(f"Warning: A project failed to export: {e.code}")
+                else:
+                    logging.warning("Warning: A project failed to export: Unexpected API response.")
+                logging.warning("Continuing with exporting other projects...")
 
     return projects, root_nodes
 
 
+def get_custom_metadata(project, api_host, **kwargs):
+    """Get resource type, language and funding info for a project.
+
+    These share a specific endpoint that isn't linked to in nodes' responses.
+
+    Parameters
+    --------------
+        project: dict
+            JSON data for the project.
+        api_host: str
+            API host to use for calls.
+        dryrun: bool
+            If True, use stub data instead of calling the API.
+        pat: str
+            Personal Access Token to authenticate users with.
+
+    Returns
+    --------------
+        attributes: dict
+            Attributes of the project's custom metadata record.
+    """
+
+    dryrun = kwargs.pop('dryrun', True)
+    pat = kwargs.pop('pat', '')
+    if dryrun:
+        metadata = MockAPIResponse.read('custom_metadata')
+    else:
+        metadata = json_loads(call_api(
+            f"{api_host}/custom_item_metadata_records/{project['id']}/",
+            pat
+        ).read())
+    return metadata['data']['attributes']
+
+
+def format_date(timestamp):
+    """Render an ISO timestamp as yyyy-mm-dd hour:minute UTC (24hr)."""
+
+    return datetime.datetime.fromisoformat(timestamp).astimezone(
+        datetime.timezone.utc
+    ).strftime('%Y-%m-%d %H:%M %Z')
+
+
 def get_category(project, **kwargs):
     """Get category from a project dictionary"""
 
-    # Define nice representations of categories if needed
-    CATEGORY_STRS = {
-        '': 'Uncategorized',
-        'methods and measures': 'Methods and Measures'
-    }
-    if project['attributes']['category'] in CATEGORY_STRS:
-        return CATEGORY_STRS[project['attributes']['category']]
-    else:
-        return project['attributes']['category'].title()
+    category = project['attributes']['category']
+    return CATEGORY_STRS.get(category) or category.title()
 
 
 def get_tags(project, **kwargs):
     """Get tags from a project dictionary"""
 
-    if project['attributes']['tags']:
-        return ', '.join(project['attributes']['tags'])
+    tags = project['attributes']['tags']
+    if tags:
+        return ', '.join(tags)
     else:
         return 'NA'
 
@@ -838,7 +1058,7 @@ def get_contributors(project, **kwargs):
         # Otherwise just pass a placeholder dict
         try:
             link = project['relationships'][key]['links']['related']['href']
-            json_data = json.loads(
+            json_data = json_loads(
                 call_api(
                     link, pat,
                     filters=URL_FILTERS.get(key, {})
@@ -847,14 +1067,14 @@ def get_contributors(project, **kwargs):
         except KeyError:
             json_data = {'data': None}
     else:
-        json_data = MockAPIResponse.read(key)
+        json_data = MockAPIResponse.read(key, shared=True)
     values = []
     for item in json_data['data']:
+        user = item['embeds']['users']['data']
         values.append((
-            item['embeds']['users']['data']
-            ['attributes']['full_name'],
+            user['attributes']['full_name'],
             item['attributes']['bibliographic'],
-            item['embeds']['users']['data']['links']['html']
+            user['links']['html']
         ))
     return values
 
@@ -868,7 +1088,7 @@ def get_affiliated_institutions(project, **kwargs):
         # Otherwise just pass a placeholder dict
         try:
             link = project['relationships'][key]['links']['related']['href']
-            json_data = json.loads(
+            json_data = json_loads(
                 call_api(
                     link, pat,
                     filters=URL_FILTERS.get(key, {})
@@ -877,7 +1097,7 @@ def get_affiliated_institutions(project, **kwargs):
         except KeyError:
             json_data = {'data': None}
     else:
-        json_data = MockAPIResponse.read(key)
+        json_data = MockAPIResponse.read(key, shared=True)
     values = []
     for item in json_data['data']:
         values.append(item['attributes']['name'])
@@ -896,7 +1116,7 @@ def get_identifiers(project, **kwargs):
         # Otherwise just pass a placeholder dict
         try:
             link = project['relationships'][key]['links']['related']['href']
-            json_data = json.loads(
+            json_data = json_loads(
                 call_api(
                     link, pat,
                     filters=URL_FILTERS.get(key, {})
@@ -905,7 +1125,7 @@ def get_identifiers(project, **kwargs):
         except KeyError:
             json_data = {'data': None}
     else:
-        json_data = MockAPIResponse.read(key)
+        json_data = MockAPIResponse.read(key, shared=True)
     values = []
     for item in json_data['data']:
         values.append(item['attributes']['value'])
@@ -922,7 +1142,7 @@ def get_license(project, **kwargs):
         # Otherwise just pass a placeholder dict
         try:
             link = project['relationships'][key]['links']['related']['href']
-            json_data = json.loads(
+            json_data = json_loads(
                 call_api(
                     link, pat,
                     filters=URL_FILTERS.get(key, {})
@@ -931,7 +1151,7 @@ def get_license(project, **kwargs):
         except KeyError:
             json_data = {'data': None}
     else:
-        json_data = MockAPIResponse.read(key)
+        json_data = MockAPIResponse.read(key, shared=True)
     if json_data['data'] is not None:
         return json_data['data']['attributes']['name']
     else:
@@ -947,7 +1167,7 @@ def get_subjects(project, **kwargs):
         # Otherwise just pass a placeholder dict
         try:
             link = project['relationships'][key]['links']['related']['href']
-            json_data = json.loads(
+            json_data = json_loads(
                 call_api(
                     link, pat,
                     filters=URL_FILTERS.get(key, {})
@@ -956,7 +1176,7 @@ def get_subjects(project, **kwargs):
         except KeyError:
             raise KeyError()  # Subjects should have a href link
     else:
-        json_data = MockAPIResponse.read(key)
+        json_data = MockAPIResponse.read(key, shared=True)
     values = []
     for item in json_data['data']:
         values.append(item['attributes']['text'])
@@ -1,17 +1,25 @@
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+import copy
 import datetime
+import functools
 import os
 import io
 import html
 
+from fontTools import ttLib
 import PIL
 from fpdf import FPDF, Align
-from fpdf.fonts import FontFace
+from fpdf.fonts import FontFace, SubsetMap, TTFFont
 from fpdf.image_parsing import get_img_info
 from mistletoe import markdown, HTMLRenderer
 import qrcode
 import urllib
 import re
 
+# Characters to replace in file names, as some systems don't allow them
+_FILENAME_UNSAFE_RE = re.compile(r'[\s/\\:*?"<>|]')
+# Sources of inline Markdown images, e.g. ![alt](https://osf.io/x.png)
+_MD_IMAGE_RE = re.compile(r'!\[[^\]]*\]\(\s*<?([^\s)>]+)')
 _EMOJI_RE = re.compile(r'([\U0001F300-\U0001FAFF\U00002700-\U000027BF\U00002600-\U000026FF])')
 
 def wrap_emoji_with_font(html_text: str) -> str:
@@ -46,21 +54,21 @@ class HTMLImageSizeCapRenderer(HTMLRenderer):
         template = '<img src="{}" alt="{}"{}{}{} />'
 
         # Cap image size if needed so they can fit on the page
-        try:
-            img_info = get_img_info(token.src)
-        except (urllib.error.HTTPError, PIL.UnidentifiedImageError):
+        img_size = get_image_size(token.src)
+        if img_size is None:
             return f'<a href="{html.escape(token.src)}">{token.src}</a>'
+        img_width, img_height = img_size
 
-        if img_info['w'] > HTMLImageSizeCapRenderer.max_width:
+        if img_width > HTMLImageSizeCapRenderer.max_width:
             new_width = HTMLImageSizeCapRenderer.max_width
         else:
-            new_width = img_info['w']
+            new_width = img_width
         width = ' width="{}"'.format(html.escape(str(new_width)))
 
-        if img_info['h'] > HTMLImageSizeCapRenderer.max_height:
+        if img_height > HTMLImageSizeCapRenderer.max_height:
             new_height = HTMLImageSizeCapRenderer.max_height
         else:
-            new_height = img_info['h']
+            new_height = img_height
         height = ' height="{}"'.format(html.escape(str(new_height)))
 
         if token.title:
@@ -70,12 +78,138 @@ class HTMLImageSizeCapRenderer(HTMLRenderer):
         return template.format(token.src, self.render_to_plain(token), title, width, height)
 
 
+# Nicer display names for certain PDF fields
+PDF_DISPLAY_NAMES = {
+    'identifiers': 'DOI',
+    'funders': 'Support/Funding Information'
+}
+
+
+@functools.lru_cache(maxsize=None)
+def get_display_name(key):
+    """Get the name to show in a PDF for a field key, e.g. 'date_created'
+    becomes 'Date Created'.
+
+    Field keys come from a small fixed set, so results are cached.
+    """
+
+    if key in PDF_DISPLAY_NAMES:
+        return PDF_DISPLAY_NAMES[key]
+    return key.replace('_', ' ').title()
+
+
+@functools.lru_cache(maxsize=256)
+def get_image_size(src):
+    """Get the (width, height) of an image to put in a PDF.
+    Returns None if the image can't be downloaded or read.
+
+    Results are cached as this downloads the whole image. Only the size
+    is kept, not the image data.
+    """
+
+    try:
+        img_info = get_img_info(src)
+    except (urllib.error.HTTPError, PIL.UnidentifiedImageError):
+        return None
+    return img_info['w'], img_info['h']
+
+
+def prefetch_wiki_images(texts, max_workers=8):
+    """Download images in wiki Markdown side by side to get their sizes,
+    so rendering the wikis later doesn't wait on each one in turn.
+
+    Only inline images are found here. Any others are still
+    downloaded when the wiki is rendered.
+
+    Parameters
+    -----------
+        texts: Iterable[str]
+            Markdown text of each wiki.
+        max_workers: int
+            Most images to download at once.
+    """
+
+    srcs = {src for text in texts for src in _MD_IMAGE_RE.findall(text)}
+    if not srcs:
+        return
+    # Only warm the cache, rendering handles and reports any errors
+    with ThreadPoolExecutor(max_workers=min(max_workers, len(srcs))) as executor:
+        for src in srcs:
+            executor.submit(get_image_size, src)
+
+
+# Fields of fpdf2's TTFFont, as of fpdf2 2.8.3. Parsed fonts are only
+# copied between PDFs if TTFFont still has exactly these fields, as a new
+# one could need resetting for each PDF. Otherwise FPDF parses fonts itself
+_TTFFONT_FIELDS = frozenset({
+    'i', 'type', 'name', 'desc', 'glyph_ids', 'hbfont', 'sp', 'ss', 'up',
+    'ut', 'cw', 'ttffile', 'fontkey', 'emphasis', 'scale', 'subset', 'cmap',
+    'ttfont', 'missing_glyphs'
+})
+_CAN_COPY_FONTS = frozenset(TTFFont.__slots__) == _TTFFONT_FIELDS
+
+
+@functools.lru_cache(maxsize=None)
+def parse_font(fname, fontkey, style):
+    """Read and parse a TrueType font file for use in PDFs.
+
+    Parsing takes longer than writing most PDFs, so each font
+    is only parsed once and copied for each PDF.
+
+    Returns
+    -----------
+        font: TTFFont
+            Parsed font, with its font file closed.
+        font_bytes: bytes
+            Contents of the font file, for copies to read from memory.
+    """
+
+    font = TTFFont(FPDF(), fname, fontkey, style)
+    # Only close the font file, as TTFFont.close() also marks the
+    # HarfBuzz font used for text shaping as made
+    font.ttfont.close()
+    with open(fname, 'rb') as file:
+        return font, file.read()
+
+
+@functools.lru_cache(maxsize=256)
+def render_wiki_html(text):
+    """Convert wiki Markdown to HTML to write to a PDF.
+
+    Results are cached, so wikis with the same content are only parsed
+    (and have their images checked) once.
+    """
+
+    html_text = markdown(text, renderer=HTMLImageSizeCapRenderer)
+    return wrap_emoji_with_font(html_text)
+
+
+@functools.lru_cache(maxsize=64)
+def render_qr_png(url):
+    """Make PNG bytes of a QR code for a URL.
+
+    Every page footer has a QR code, so results are cached to only
+    generate each code once, including across PDFs.
+    """
+
+    # Use a fixed mask pattern rather than scoring all 8 to pick one,
+    # which is most of the time spent making a code
+    qr = qrcode.QRCode(mask_pattern=0)
+    qr.add_data(url)
+    qr.make(fit=True)
+    img_byte_arr = io.BytesIO()
+    qr.make_image().save(img_byte_arr, format='PNG')
+    return img_byte_arr.getvalue()
+
+
 class PDF(FPDF):
     """Custom PDF class to implement extra customisation.
 
     Attributes:
         date_printed: datetime
             Date and time when the project was exported.
+        timestamp: str
+            date_printed as shown in page footers.
         url: str
             Current URL to include in QR codes.
         parent_url: str
@@ -104,6 +238,8 @@ class PDF(FPDF):
         self.date_printed = datetime.datetime.now(
             datetime.timezone.utc
         )
+        # Format once here as every page footer shows the same time
+        self.timestamp = self.date_printed.strftime('%Y-%m-%d %H:%M:%S %Z')
         self.url = url
         # Setup unicode font for use. Can have 4 styles
         self.font = 'dejavu-sans'
@@ -122,16 +258,37 @@ class PDF(FPDF):
             os.path.dirname(__file__), 'font', 'NotoSansSymbols2-Regular.ttf'))
 
 
+    def add_font(self, family=None, style='', fname=None, uni='DEPRECATED'):
+        """Add a TrueType font, reusing font files already parsed."""
+
+        style = ''.join(sorted(style.upper()))
+        fontkey = f'{family.lower()}{style}' if family else None
+        if not _CAN_COPY_FONTS or not fname or not fontkey or fontkey in self.fonts:
+            # Let FPDF handle (and warn about) anything unusual
+            return super().add_font(family, style, fname, uni)
+
+        # Copy the parsed font, but give it its own subset of characters
+        # and font file as these change as text is written. The font file
+        # is read from memory, so no file is left open if the PDF isn't output
+        parsed_font, font_bytes = parse_font(fname, fontkey, style)
+        font = copy.copy(parsed_font)
+        font.i = len(self.fonts) + 1
+        font.ttfont = ttLib.TTFont(
+            io.BytesIO(font_bytes), recalcTimestamp=False, fontNumber=0, lazy=True
+        )
+        font.missing_glyphs = []
+        font.subset = SubsetMap(font)
+        if hasattr(font, 'hbfont'):
+            # Made again on first use, as its size is set for each text shaped
+            del font.hbfont
+        self.fonts[fontkey] = font
+
     def generate_qr_code(self):
         """
         Make a QR code based on the current PDF's URL.
         """
 
-        qr = qrcode.make(self.url)
-        img_byte_arr = io.BytesIO()
-        qr.save(img_byte_arr, format='PNG')
-        img_byte_arr.seek(0)
-        return img_byte_arr
+        return io.BytesIO(render_qr_png(self.url))
 
     def footer(self):
         """
@@ -143,15 +300,32 @@ class PDF(FPDF):
         self.set_font(self.font, size=PDF.FONT_SIZES['h5'])
         self.cell(0, 10, f"Page: {self.page_no()}", align="C")
         self.set_x(10)
-        timestamp = self.date_printed.strftime(
-            '%Y-%m-%d %H:%M:%S %Z'
-        )
-        self.cell(0, 10, f"Exported: {timestamp}", align="L")
+        self.cell(0, 10, f"Exported: {self.timestamp}", align="L")
         self.set_x(10)
         self.set_y(-15)
         qr_img = self.generate_qr_code()
         self.image(qr_img, w=15, h=15, x=Align.C)
 
+    def _write_fields(self, fields):
+        """Write simple key-value fields inplace to a PDF, one per line.
+
+        Each field gets its own cell, so Markdown markers left open
+        in one value (e.g. the '--' in '2019--2020') can't change the
+        style of the fields after it.
+
+        Parameters
+        -----------
+            fields: list[tuple[str, str]]
+                Pairs of (key, value) for each field to write.
+        """
+
+        for key, value in fields:
+            self.multi_cell(
+                w=PDF.CELL_WIDTH, h=None,
+                text=f'**{get_display_name(key)}:** {value}\n',
+                align='L', markdown=True, padding=PDF.LINE_PADDING
+            )
+
     def _write_list_section(self, key, fielddict):
         """Handle writing fields of different types inplace to a PDF.
         Possible types are lists, strings or dictionaries.
@@ -168,19 +342,11 @@ class PDF(FPDF):
                 }
         """
 
-        # Set nicer display names for certain PDF fields
-        pdf_display_names = {
-            'identifiers': 'DOI',
-            'funders': 'Support/Funding Information'
-        }
-        if key in pdf_display_names:
-            field_name = pdf_display_names[key]
-        else:
-            field_name = key.replace('_', ' ').title()
+        field_name = get_display_name(key)
 
         if isinstance(fielddict[key], list):
             # Create separate paragraphs for more complex attributes
-            self.write(0, '\n')
+            self.ln(self.font_size)
             self.set_font(self.font, size=PDF.FONT_SIZES['h3'])
             self.multi_cell(
                 w=PDF.CELL_WIDTH, h=None,
@@ -190,17 +356,7 @@ class PDF(FPDF):
             self.set_font(self.font, size=PDF.FONT_SIZES['h4'])
             if len(fielddict[key]) > 0:
                 for idx, item in enumerate(fielddict[key]):
-                    for subkey in item.keys():
-                        if subkey in pdf_display_names:
-                            field_name = pdf_display_names[subkey]
-                        else:
-                            field_name = subkey.replace('_', ' ').title()
-
-                        self.multi_cell(
-                            w=PDF.CELL_WIDTH, h=None,
-                            text=f'**{field_name}:** {item[subkey]}\n',
-                            align='L', markdown=True, padding=PDF.LINE_PADDING
-                        )
+                    self._write_fields(list(item.items()))
                     if idx < len(fielddict[key])-1:
                         self.ln()
                         self.set_x(9)
@@ -212,14 +368,7 @@ class PDF(FPDF):
                 )
         else:
             # Simple key-value attributes can go on one-line
-            self.multi_cell(
-                w=PDF.CELL_WIDTH,
-                h=None,
-                text=f'**{field_name}:** {fielddict[key]}\n',
-                align='L',
-                markdown=True,
-                padding=PDF.LINE_PADDING
-            )
+            self._write_fields([(key, fielddict[key])])
 
     def _write_project_body(self, project):
         """Write inplace the body of a project to the PDF.
@@ -243,8 +392,7 @@ class PDF(FPDF):
             self.write(h=0, text=f'{parent[1]}\n', link=parent[1])
             self.ln(h=5)
 
-        # Pop URL field to avoid printing it out in Metadata section
-        url = project['metadata'].pop('url', '')
+        url = project['metadata'].get('url', '')
         self.url = url  # Set current URL to use in QR codes
         qr_img = self.generate_qr_code()
         self.image(qr_img, w=30, x=180, y=5)
@@ -265,6 +413,8 @@ class PDF(FPDF):
             align='L', padding=PDF.LINE_PADDING)
         self.set_font(self.font, size=PDF.FONT_SIZES['h4'])
         for key in project['metadata']:
+            if key == 'url':
+                continue  # Already shown under the title
             self._write_list_section(key, project['metadata'])
         self.ln(h=7)
 
@@ -277,22 +427,14 @@ class PDF(FPDF):
             headings_style=PDF.HEADINGS_STYLE,
             col_widths=(0.8, 0.5, 1.2), align="LEFT"
         ) as table:
-            row = table.row()
-            row.cell('Name')
-            row.cell('Bibliographic?')
-            row.cell('Profile Link')
+            table.row(('Name', 'Bibliographic?', 'Profile Link'))
             self.set_font(self.font, size=PDF.FONT_SIZES['h5'])
-            for data_row in project['contributors']:
-                row = table.row()
-                for idx, datum in enumerate(data_row):
-                    if datum is True:
-                        datum = 'Yes'
-                    if datum is False:
-                        datum = 'No'
-                    if idx == 2:
-                        row.cell(text=datum, link=datum, style=self.LINK_STYLE)
-                    else:
-                        row.cell(datum)
+            for name, bibliographic, link in project['contributors']:
+                table.row((
+                    name,
+                    'Yes' if bibliographic else 'No',
+                    {'text': link, 'link': link, 'style': self.LINK_STYLE}
+                ))
         self.ln(h=7)
 
         # List files stored in storage providers
@@ -308,29 +450,23 @@ class PDF(FPDF):
                 headings_style=PDF.HEADINGS_STYLE,
                 col_widths=(1, 0.3, 1.2), align="LEFT"
             ) as table:
-                self.set_font(self.font, size=PDF.FONT_SIZES['h4'])
-                row = table.row()
-                row.cell('File Name')
-                row.cell('Size (MB)')
-                row.cell('Download Link')
+                table.row(('File Name', 'Size (MB)', 'Download Link'))
                 self.set_font(self.font, size=PDF.FONT_SIZES['h5'])
-                for data_row in project['files']:
-                    row = table.row()
-                    for idx, datum in enumerate(data_row):
-                        if datum is True:
-                            datum = 'Yes'
-                        if datum is False or datum is None:
-                            datum = 'N/A'
-                        if idx == 2:
-                            row.cell(text=datum, link=datum, style=self.LINK_STYLE)
-                        else:
-                            row.cell(datum)
+                for path, size, link in project['files']:
+                    # Show missing sizes and links as N/A
+                    size = 'N/A' if size is None else size
+                    link = 'N/A' if link is None else link
+                    table.row((
+                        path,
+                        size,
+                        {'text': link, 'link': link, 'style': self.LINK_STYLE}
+                    ))
         else:
-            self.write(0, '\n')
+            self.ln(self.font_size)
             self.multi_cell(
                 w=PDF.CELL_WIDTH, h=None, text='No files found for this project.\n', align='L'
             )
-            self.write(0, '\n')
+            self.ln(self.font_size)
         self.ln(h=10)
 
         # Write wikis separately to more easily handle Markdown parsing
@@ -352,10 +488,12 @@ class PDF(FPDF):
 
         """
 
+        wiki_html = {wiki: render_wiki_html(text) for wiki, text in wikis.items()}
+
         for i, wiki in enumerate(wikis.keys()):
             self.add_page()
+            self.set_font(self.font, size=PDF.FONT_SIZES['h2'], style='B')
             if i == 0:
-                self.set_font(self.font, size=PDF.FONT_SIZES['h2'], style='B')
                 title_template = '4. Wiki ({}{}{})'
                 if parent:
                     header = title_template.format(f'Parent: {parent[0]}', ' | ', title)
@@ -365,20 +503,13 @@ class PDF(FPDF):
                     w=PDF.CELL_WIDTH, h=None, text=f'{header}\n',
                     align='L')
                 self.ln()
-            self.set_font(self.font, size=PDF.FONT_SIZES['h2'], style='B')
             self.multi_cell(w=PDF.CELL_WIDTH, h=None, text=f'{wiki}\n')
             self.set_font(self.font, size=PDF.FONT_SIZES['h4'])
-            html = markdown(
-                wikis[wiki],
-                renderer=HTMLImageSizeCapRenderer
-)
-            html = wrap_emoji_with_font(html)
-            self.write_html(html)
+            self.write_html(wiki_html[wiki])
 
 
-
-def explore_project_tree(project, projects, pdf=None):
-    """Recursively find child projects and write them to a PDF.
+def explore_project_tree(project, projects, pdf=None, projects_by_id=None):
+    """Find child projects and write them to a PDF, depth first.
 
     Parameters
     -----------
@@ -388,6 +519,9 @@ def explore_project_tree(project, projects, pdf=None):
             List of all projects to explore.
         pdf: PDF
             PDF object to write to. If None, a new PDF will be created.
+        projects_by_id: dict[str, dict]
+            Projects keyed by their ID, for finding children.
+            If None, this is built from the projects list.
 
     Returns
     -----------
@@ -398,23 +532,40 @@ def explore_project_tree(project, projects, pdf=None):
     if not pdf:
         pdf = PDF()
 
-    pdf.set_line_width(0.05)
-    pdf.set_left_margin(10)
-    pdf.set_right_margin(30)
-
-    # Add current project to PDF
-    pdf._write_project_body(project)
-
-    # Do children last so that they come at end of the PDF
-    children = project['children']
-    for child_id in children:
-        child_project = next(
-            (p for p in projects if p['metadata']['id'] == child_id), None
-        )
-        if child_project:
-            pdf = explore_project_tree(
-                child_project, projects, pdf=pdf
-            )
+    # Look up children by ID rather than searching the list for each one
+    # Keep the first project found for an ID, as a list search would
+    if projects_by_id is None:
+        projects_by_id = {}
+        for p in projects:
+            projects_by_id.setdefault(p['metadata']['id'], p)
+
+    # Find projects in the order they are written first
+    # Use a stack rather than recursion so deep component trees
+    # can't hit the recursion limit
+    tree = []
+    stack = [project]
+    while stack:
+        curr_project = stack.pop()
+        tree.append(curr_project)
+
+        # Do children last so that they come at end of the PDF
+        # Push in reverse so the first child is written next
+        for child_id in reversed(curr_project['children']):
+            child_project = projects_by_id.get(child_id)
+            if child_project:
+                stack.append(child_project)
+
+    prefetch_wiki_images(
+        text for curr_project in tree for text in curr_project['wikis'].values()
+    )
+
+    for curr_project in tree:
+        pdf.set_line_width(0.05)
+        pdf.set_left_margin(10)
+        pdf.set_right_margin(30)
+
+        # Add current project to PDF
+        pdf._write_project_body(curr_project)
 
     return pdf
 
@@ -445,19 +596,85 @@ def write_pdf(projects, root_idx, folder=''):
     title = curr_project['metadata']['title']
     pdf = explore_project_tree(curr_project, projects)
 
-    # Remove spaces in file name for better behaviour on Linux
+    # Remove spaces and path separators in file name for better behaviour
     # Add timestamp to allow distinguishing between PDFs at a glance
-    timestamp = pdf.date_printed.strftime(
-        '%Y-%m-%d %H-%M-%S %Z'
-    ).replace(' ', '-')
-    filename = f'{title.replace(' ', '-')}-{timestamp}.pdf'
+    timestamp = pdf.date_printed.strftime('%Y-%m-%d-%H-%M-%S-%Z')
+    filename = f'{_FILENAME_UNSAFE_RE.sub('-', title)}-{timestamp}.pdf'
 
+    out_dir = os.path.join(os.getcwd(), folder)
     if folder:
-        if not os.path.exists(folder):
-            os.mkdir(folder)
-        path = os.path.join(os.getcwd(), folder, filename)
-    else:
-        path = os.path.join(os.getcwd(), filename)
+        os.makedirs(out_dir, exist_ok=True)
+    path = os.path.join(out_dir, filename)
     pdf.output(path)
 
     return pdf, path
+
+
+# Projects shared with PDF worker processes, set once per worker
+_worker_projects = []
+
+
+def _init_pdf_worker(projects):
+    global _worker_projects
+    _worker_projects = projects
+
+
+class _WorkerHTTPError(Exception):
+    """HTTPError raised in a PDF worker process.
+
+    HTTPError can't be unpickled, so this carries what is needed to
+    raise it again in the main process.
+    """
+
+    def __init__(self, url, code, msg):
+        super().__init__(url, code, msg)
+
+
+def _write_worker_pdf(root_idx, folder):
+    try:
+        return write_pdf(_worker_projects, root_idx, folder)[1]
+    except urllib.error.HTTPError as e:
+        raise _WorkerHTTPError(e.url, e.code, e.msg) from None
+
+
+def write_pdfs(projects, root_idxs, folder='', max_workers=None):
+    """Make PDFs for several root projects, using a process for each
+    PDF being written at once. Building PDFs is CPU-bound, so threads
+    would not speed this up.
+
+    Parameters
+    ------------
+        projects: dict[str, str|tuple]
+            Projects found to export into the PDFs.
+        root_idxs: list[int]
+            Positions of root nodes (no parent) in the projects list.
+        folder: str
+            The path to the folder to output the project PDFs in.
+            Default is the current working directory.
+        max_workers: int
+            Most PDFs to write at once. Default is the number of CPUs.
+
+    Yields
+    ------------
+        path: str
+            Path to each PDF file, in the same order as root_idxs.
+    """
+
+    # Not worth starting processes for a single PDF
+    if len(root_idxs) < 2:
+        for root_idx in root_idxs:
+            yield write_pdf(projects, root_idx, folder)[1]
+        return
+
+    # Send the projects to each worker once rather than with every PDF
+    with ProcessPoolExecutor(
+        max_workers=max_workers,
+        initializer=_init_pdf_worker, initargs=(projects,)
+    ) as executor:
+        try:
+            yield from executor.map(
+                _write_worker_pdf, root_idxs, [folder] * len(root_idxs)
+            )
+        except _WorkerHTTPError as e:
+            url, code, msg = e.args
+            raise urllib.error.HTTPError(url, code, msg, hdrs=None, fp=None) from e
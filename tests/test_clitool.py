@@ -1,20 +1,30 @@
 from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+import copy
 import datetime
+import functools
+import io
+import unittest
 from unittest import TestCase
 import os
-import shutil
+import pickle
+import tempfile
+import subprocess
+import sys
+import threading
+import time
 import json
 import traceback
 import urllib.error
+import urllib.parse
 from unittest.mock import patch, MagicMock, call
 import importlib.metadata
 
 import PIL
-from click.testing import CliRunner
-from pypdf import PdfReader
-from mistletoe import markdown
+from mistletoe import Document, markdown
 
 from osfexport.exporter import (
+    API_WORKERS,
     MockAPIResponse,
     call_api,
     get_project_data,
@@ -23,6 +33,7 @@ from osfexport.exporter import (
     explore_wikis,
     is_public,
     extract_project_id,
+    json_loads,
     paginate_json_result
 )
 from osfexport.cli import (
@@ -30,16 +41,264 @@ from osfexport.cli import (
 )
 from osfexport.formatter import (
     HTMLImageSizeCapRenderer,
-    write_pdf
+    PDF,
+    get_image_size,
+    prefetch_wiki_images,
+    _WorkerHTTPError,
+    _init_pdf_worker,
+    _write_worker_pdf,
+    render_qr_png,
+    write_pdf,
+    write_pdfs
 )
 
 TEST_PDF_FOLDER = 'good-pdfs'
 TEST_INPUT = 'test_pdf.pdf'
-FOLDER_OUT = os.path.join('tests', 'outfolder')
-
-
+OSFEXPORT_VERSION = importlib.metadata.version('osfexport')
+# API errors for mocks to raise
+HTTP_401 = urllib.error.HTTPError(
+    url='https://test.osf.io', code=401, msg=' HTTP Error 401: Unauthorized',
+    hdrs={}, fp=None
+)
+HTTP_429 = urllib.error.HTTPError(
+    url='https://test.osf.io', code=429, msg='Too many requests',
+    hdrs={}, fp=None
+)
+# Opt-in for tests that call the live test API, read once at import
+LIVE_API_TESTS = bool(os.getenv('OSF_LIVE_TESTS'))
+
+# File paths in the mock file tree, deepest folders first
+EXPECTED_MOCK_FILE_PATHS = [
+    '/tf1/tf2/file.txt',
+    '/tf1/tf2-second/secondpage.txt',
+    '/tf1/tf2-second/thirdpage.txt',
+    '/tf1/helloworld.txt.txt',
+    '/helloworld.txt.txt',
+]
+# Metadata expected from get_project_data for the dry run stubs,
+# keyed by index in the returned project list
+EXPECTED_MOCK_METADATA = {
+    0: {
+        'title': 'Test1',
+        'id': 'x',
+        'url': 'https://test.osf.io/x/',
+        'license': 'mynewlicense',
+        'description': 'Test1 Description',
+        'date_created': '2000-01-01 14:18 UTC',
+        'date_modified': '2000-01-01 14:18 UTC',
+        'tags': 'test1, test2, test3',
+        'identifiers': '10.4-2-6-25/OSF.IO/74PAD',
+        'resource_type': 'Other',
+        'resource_lang': 'eng',
+        'subjects': 'Education, Literature, Geography',
+        'public': True,
+        'category': 'Methods and Measures',
+    },
+    1: {
+        'title': 'Test2',
+        'description': 'Test2 Description',
+        'tags': 'NA',
+        'public': False,
+        'category': 'Uncategorized',
+    },
+}
+
+# Shared project data for PDF tests, parsed once at import
+DATE_CREATED = datetime.datetime.fromisoformat('2025-06-12T15:54:42.105112Z')
+DATE_MODIFIED = datetime.datetime.fromisoformat('2001-01-01T01:01:01.105112Z')
+LONG_NAME = 'Long Double-Barrelled Name and Surname'
+USER_URL = 'https://test.osf.io/userid/'
+UNICODE_PROJECTS = [
+    {
+        'metadata': {
+            'title': 'My Project Title',
+            'id': 'id',
+            'url': 'https://test.osf.io/x',
+            'category': 'Uncategorized',
+            'description': 'This is a description of the project ג',
+            'date_created': DATE_CREATED,
+            'date_modified': DATE_MODIFIED,
+            'tags': 'tag1, tag2, tag3',
+            'resource_type': 'na',
+            'resource_lang': 'english',
+            # Below uses em-dash at end
+            'affiliated_institutions': 'University of Manchester — Test',
+            'identifiers': 'N/A',
+            'license': 'Apache 2.0',
+            'subjects': 'sub1, sub2, sub3',
+        },
+        'contributors': [
+            ('Pineapple Pizza', False, USER_URL),
+            ('Margarita', True, USER_URL),
+            ('Margarine', True, USER_URL)
+        ],
+        'files': [
+            ('file1.txt', None, USER_URL),
+            ('file2.txt', None, None),
+        ],
+        'funders': [],
+        'wikis': {
+            'Home': 'hello world',
+            'Page2': 'another page'
+        },
+        "parent": None,
+        'children': ['a']
+    },
+    {
+        'metadata': {
+            "title": "child1",
+            "id": "a",
+            'url': 'https://test.osf.io/a',
+        },
+        'contributors': [
+            (LONG_NAME, False, USER_URL),
+            ('name2', True, USER_URL),
+            ('name3', True, USER_URL)
+        ],
+        'files': [
+            ('file1.txt', None, None),
+            ('file2.txt', None, None),
+        ],
+        'wikis': {},
+        "parent": ('My Project Title', 'https://test.osf.io/x'),
+        'children': ['b']
+    },
+    {
+        'metadata': {
+            "title": "Second Project in new PDF ♡",
+            "id": "c",
+            'url': 'lol',
+            'category': 'Methods and Measures'
+        },
+        'contributors': [
+            (LONG_NAME, False, USER_URL),
+            ('name2', True, USER_URL),
+            ('name3', True, USER_URL)
+        ],
+        'files': [
+            ('file1.txt', None, None),
+            ('file2.txt', None, None),
+        ],
+        'wikis': {},
+        "parent": None,
+        'children': []
+    },
+    {
+        'metadata': {
+            "title": "child2",
+            "id": "b",
+            'url': 'dan'
+        },
+        'contributors': [
+            (LONG_NAME, False, USER_URL),
+            ('name2', True, USER_URL),
+            ('name3', True, USER_URL)
+        ],
+        'files': [
+            ('file1.txt', None, None),
+            ('file2.txt', None, None),
+        ],
+        'wikis': {},
+        "parent": ['child1', 'https://test.osf.io/a'],
+        'children': []
+    },
+]
+
+# Expected text of PDF tables in layout mode, with spaces removed
+# This way of string formatting compresses line lengths used
+# End of headers and table rows marked by \n\n
+CONTRIBUTORS_TABLE = (
+    '2. Contributors\n\n'
+    'Name'
+    'Bibliographic?'
+    'Profile Link\n\n'
+    'Pineapple Pizza'
+    'No'
+    'https://test.osf.io/userid/\n\n'
+    'Margarita'
+    'Yes'
+    'https://test.osf.io/userid/\n\n'
+    'Margarine'
+    'Yes'
+    'https://test.osf.io/userid/\n\n'
+).replace(' ', '')
+FILES_TABLE = (
+    '3. Files in Main Project\n\n'
+    'OSF Storage\n\n'
+    'File Name'
+    'Size (MB)'
+    'Download Link\n\n'
+    'file1.txt'
+    'N/A'
+    'https://test.osf.io/userid/\n\n'
+    'file2.txt'
+    'N/A'
+    'N/A\n\n'
+).replace(' ', '')
+
+
+def make_test_project(title, parent=None):
+    """Make a small project with all fields filled in to write to a PDF."""
+
+    return {
+        'metadata': {
+            'title': title,
+            'id': 'id',
+            'url': 'https://test.osf.io/x',
+            'category': 'Uncategorized',
+            'description': 'This is a description of the project',
+            'date_created': DATE_CREATED,
+            'date_modified': DATE_MODIFIED,
+            'tags': 'tag1, tag2, tag3',
+            'resource_type': 'na',
+            'resource_lang': 'english',
+            'affiliated_institutions': 'University of Manchester',
+            'identifiers': 'N/A',
+            'license': 'Apache 2.0',
+            'subjects': 'sub1, sub2, sub3',
+        },
+        'contributors': [
+            ('Pineapple Pizza', False, USER_URL),
+            ('Margarita', True, USER_URL),
+            ('Margarine', True, USER_URL)
+        ],
+        'files': [
+            ('file1.txt', None, USER_URL),
+            ('file2.txt', None, None),
+        ],
+        'funders': [],
+        'wikis': {
+            'Home': 'hello world',
+            'Page2': 'another page'
+        },
+        'parent': parent,
+        'children': ['a']
+    }
+
+
+@functools.lru_cache(maxsize=8)
+def _cached_mock_nodes(project_id=''):
+    return get_nodes(pat='', dryrun=True, usetest=True, project_id=project_id)
+
+
+def mock_nodes(project_id=''):
+    """Get projects and root nodes from the dry run stubs.
+
+    Stubs are only parsed once per project ID, and copies are returned
+    so that tests can't affect each other by changing the results.
+    """
+
+    return copy.deepcopy(_cached_mock_nodes(project_id))
+
+
+@unittest.skipUnless(
+    LIVE_API_TESTS, 'OSF_LIVE_TESTS not set, skipping live API tests'
+)
 class TestAPI(TestCase):
-    """Tests for interacting with the OSF API."""
+    """Tests for interacting with the OSF API.
+
+    These make real calls to the test API, so only run if OSF_LIVE_TESTS is set.
+    """
 
     API_HOST = 'https://api.test.osf.io/v2'
 
@@ -52,7 +311,7 @@ class TestAPI(TestCase):
         )
         assert data.status == 200
 
-        data = json.loads(data.read())
+        data = json_loads(data.read())
         assert isinstance(data, dict)
         # All mocked data assumes API version 2.20 is used
         assert data['meta']['version'] == '2.20', (
@@ -65,7 +324,7 @@ class TestAPI(TestCase):
         assert is_public(f'{TestAPI.API_HOST}')
 
     def test_get_public_projects_if_no_pat(self):
-        public_node_id = json.loads(
+        public_node_id = json_loads(
             call_api(
                 f'{TestAPI.API_HOST}/nodes', pat='',
                 per_page=1,
@@ -84,77 +343,130 @@ class TestAPI(TestCase):
         # Use first public project available for this test
         # TODO: allow choosing individual components to start export from
         # Currently using a component will cause a fail
+        # Embed children so the expected count comes from the same request
         data = call_api(
-            f'{TestAPI.API_HOST}/nodes/',
+            f'{TestAPI.API_HOST}/nodes/?embed=children',
             pat='',
             per_page=1,
             filters={
                 'parent': ''
             }
         )
-        node = json.loads(data.read())['data'][0]
+        node = json_loads(data.read())['data'][0]
         id = extract_project_id(node['links']['html'])
         projects, root_projects = get_nodes(
             pat='', dryrun=False,
             usetest=True, project_id=id
         )
 
-        expected_child_count = len(
-            json.loads(
-                call_api(
-                    f'{TestAPI.API_HOST}/nodes/{node["id"]}/children/',
-                    pat=''
-                ).read()
-            )['data']
-        )
+        expected_child_count = len(node['embeds']['children']['data'])
         assert len(projects) == expected_child_count + 1
         assert len(root_projects) == 1, (root_projects)
         assert projects[0]['metadata']['title'] == node['attributes']['title']
         assert isinstance(projects[0]['files'], list)
 
-    def test_write_image_html_with_new_size(self):
-        url = 'https://osf.io/download/x/'
-        text = f"""This has an image in the wiki page.
-![Someone taking a pic on their phone camera][1]This is an image above this text.
-Another paragraph.
 
-  [1]: {url}"""
+class TestAPIMocked(TestCase):
+    """Offline versions of the API tests, with HTTP calls mocked.
 
-        # Mock requests to simulate errors when trying to download images
-        with patch('urllib.request.urlopen') as mock_get:
-            mock_get.side_effect = urllib.error.HTTPError(
-                url='https://osf.io/download/x/',
-                code=401,
-                msg='Unauthorized',
-                hdrs={},
-                fp=None
-            )
-            html = markdown(text, renderer=HTMLImageSizeCapRenderer)
-            assert f'<a href="{url}">{url}</a>' in html, (
-                f'<a href="{url}">{url}</a>',
-                html
-            )
-        with patch('urllib.request.urlopen') as mock_get:
-            mock_get.side_effect = PIL.UnidentifiedImageError()
-            html = markdown(text, renderer=HTMLImageSizeCapRenderer)
-            assert f'<a href="{url}">{url}</a>' in html, (
-                f'<a href="{url}">{url}</a>',
-                html
+    Responses are served from the stub JSON files used for dry runs,
+    so the code paths for real API calls can be tested without a network.
+    """
+
+    API_HOST = 'https://api.test.osf.io/v2'
+
+    def setUp(self):
+        # Map (path, kind filter) pairs for file tree stubs and paths
+        # for everything else to parsed response bodies
+        self.responses = {
+            f'{TestAPIMocked.API_HOST}/': {'meta': {'version': '2.20'}},
+            f'{TestAPIMocked.API_HOST}': {'meta': {'version': '2.20'}},
+            f'{TestAPIMocked.API_HOST}/users/me': 401,
+            f'{TestAPIMocked.API_HOST}/nodes': MockAPIResponse.read('nodes'),
+            f'{TestAPIMocked.API_HOST}/nodes/x/': MockAPIResponse.read('x'),
+        }
+        for field in MockAPIResponse.JSON_FILES:
+            name, _, kind = field.rpartition('_')
+            if kind in ('folder', 'files'):
+                self.responses[(name, kind.rstrip('s'))] = MockAPIResponse.read(field)
+
+        patcher = patch('urllib.request.urlopen', side_effect=self.mock_urlopen)
+        self.mock_urlopen_obj = patcher.start()
+        self.addCleanup(patcher.stop)
+        # Stub links are names rather than full URLs, which Request rejects
+        patcher = patch(
+            'urllib.request.Request',
+            side_effect=lambda url, method: MagicMock(full_url=url)
+        )
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def mock_urlopen(self, request):
+        """Return a fake response for a request, or raise its HTTP error code."""
+
+        path, _, query = request.full_url.partition('?')
+        kind = urllib.parse.parse_qs(query).get('filter[kind]', [None])[0]
+        body = self.responses.get((path, kind), self.responses.get(path, 404))
+        if isinstance(body, int):
+            raise urllib.error.HTTPError(
+                url=request.full_url, code=body, msg='HTTP Error', hdrs={}, fp=None
             )
+        response = MagicMock()
+        response.status = 200
+        response.read.return_value = json.dumps(body).encode('utf-8')
+        return response
+
+    def test_basic_api_call_works(self):
+        data = call_api(f'{TestAPIMocked.API_HOST}/', pat='')
+        assert data.status == 200
+
+        data = json_loads(data.read())
+        assert data['meta']['version'] == '2.20', (
+            data['meta']['version']
+        )
+
+    def test_get_public_status_on_code(self):
+        assert not is_public(f'{TestAPIMocked.API_HOST}/users/me')
+        assert is_public(f'{TestAPIMocked.API_HOST}')
+
+    def test_get_public_projects_if_no_pat(self):
+        public_node_id = json_loads(
+            call_api(
+                f'{TestAPIMocked.API_HOST}/nodes', pat='',
+                per_page=1,
+                filters={
+                    'parent': ''
+                }
+            ).read()
+        )['data'][0]['id']
+
+        result = call_api(
+            f'{TestAPIMocked.API_HOST}/nodes/{public_node_id}/', pat='',
+        )
+        assert result.status == 200
+        assert self.mock_urlopen_obj.call_count == 2
+
+    def test_explore_api_file_tree(self):
+        files = explore_file_tree('root', pat='', dryrun=False)
+        mock_files = explore_file_tree('root', pat='', dryrun=True)
+        assert files == mock_files, (files, mock_files)
+        assert len(files) == 5, files
 
 
 class TestExporter(TestCase):
     """Tests for the exporter without real API usage."""
 
+    @classmethod
+    def setUpClass(cls):
+        # Mock urlopen once for all tests so none make real HTTP calls
+        cls.mock_urlopen = cls.enterClassContext(patch('urllib.request.urlopen'))
+
+    def setUp(self):
+        self.mock_urlopen.reset_mock(return_value=True, side_effect=True)
+
     @patch('osfexport.exporter.get_affiliated_institutions')
     def test_get_project_data_handles_HTTP_errors(self, mock_get_inst):
-        mock_get_inst.side_effect = urllib.error.HTTPError(
-            url='https://test.osf.io',
-            code=401,
-            msg=' HTTP Error 401: Unauthorized',
-            hdrs={},
-            fp=None
-        )
+        mock_get_inst.side_effect = HTTP_401
         nodes = MockAPIResponse.read('nodes')
         projects, root_nodes = get_project_data(
             nodes,
@@ -169,13 +481,7 @@ class TestExporter(TestCase):
             f'Wrong num of calls: {mock_get_inst.call_count}'
         )
 
-        mock_get_inst.side_effect = urllib.error.HTTPError(
-            url='https://test.osf.io',
-            code=429,
-            msg='Too many requests',
-            hdrs={},
-            fp=None
-        )
+        mock_get_inst.side_effect = HTTP_429
         nodes = MockAPIResponse.read('nodes')
         with self.assertRaises(urllib.error.HTTPError):
             projects, root_nodes = get_project_data(
@@ -187,13 +493,7 @@ class TestExporter(TestCase):
 
     @patch('osfexport.exporter.get_project_data')
     def test_paginate_json_result_gets_next_page_despite_function_errors(self, mock_get_data):
-        mock_get_data.side_effect = urllib.error.HTTPError(
-            url='https://test.osf.io',
-            code=401,
-            msg=' HTTP Error 401: Unauthorized',
-            hdrs={},
-            fp=None
-        )
+        mock_get_data.side_effect = HTTP_401
         results = paginate_json_result(
             start='nodes', action=mock_get_data, dryrun=True, usetest=False,
             pat='', filters={}, project_id='', per_page=20, fail_on_first=False
@@ -212,43 +512,75 @@ class TestExporter(TestCase):
             )
 
         # Raise error if it's HTTP 429 error code
-        mock_get_data.side_effect = urllib.error.HTTPError(
-            url='https://test.osf.io',
-            code=429,
-            msg='Too many requests',
-            hdrs={},
-            fp=None
-        )
+        mock_get_data.side_effect = HTTP_429
         with self.assertRaises(urllib.error.HTTPError):
             results = paginate_json_result(
                 start='nodes', action=mock_get_data, dryrun=True, usetest=False,
                 pat='', filters={}, project_id='', per_page=20, fail_on_first=False
             )
 
-    @patch('urllib.request.urlopen')
     @patch('urllib.request.Request')
-    def test_call_api_add_headers(self, mock_request_class, mock_urlopen):
+    def test_call_api_add_headers(self, mock_request_class):
         # Mock Request instances to check headers
-        # Mock urlopen to avoid real HTTP calls
         mock_request_instance = MagicMock()
         mock_request_class.return_value = mock_request_instance
         call_api('https://test.osf.io', pat='pat', is_json=True)
-        version = importlib.metadata.version("osfexport")
         expected_calls = [
             call().add_header('Authorization', 'Bearer pat'),
-            call().add_header('User-Agent', f'osfexport/{version} (Python)'),
+            call().add_header('User-Agent', f'osfexport/{OSFEXPORT_VERSION} (Python)'),
             call().add_header('Accept', 'application/vnd.api+json;version=2.20')
         ]
         mock_request_class.assert_has_calls(expected_calls, any_order=False)
 
-    @patch('urllib.request.urlopen')
     @patch('urllib.request.Request')
-    def test_call_api_handle_429_errors(self, mock_request_class, mock_urlopen):
+    def test_call_api_keeps_existing_query(self, mock_request_class):
+        call_api('https://test.osf.io/nodes/?embed=children', pat='', per_page=1)
+        url = mock_request_class.call_args.args[0]
+        assert url.startswith('https://test.osf.io/nodes/?embed=children&'), url
+        assert url.count('?') == 1, url
+
+    @patch('urllib.request.Request')
+    def test_call_api_builds_query_string(self, mock_request_class):
+        call_api('https://test.osf.io/nodes/', pat='')
+        url = mock_request_class.call_args.args[0]
+        assert url == 'https://test.osf.io/nodes/?page[size]=100', url
+
+        call_api(
+            'https://test.osf.io/nodes/', pat='', per_page=0,
+            filters={'parent': '', 'title': 'a b', 'ignored': {}}
+        )
+        url = mock_request_class.call_args.args[0]
+        assert url == 'https://test.osf.io/nodes/?filter[parent]=&filter[title]=a+b', url
+
+    def test_call_api_reuses_unchanged_cached_responses(self):
+        response = MagicMock(status=200, headers={'ETag': '"v1"'})
+        response.read.return_value = b'{"data": []}'
+        not_modified = urllib.error.HTTPError(
+            url='https://test.osf.io', code=304, msg='Not Modified', hdrs={},
+            fp=io.BytesIO()
+        )
+        self.mock_urlopen.side_effect = [response, not_modified]
+
+        with tempfile.TemporaryDirectory() as folder, \
+                patch('osfexport.exporter.RESPONSE_CACHE_DIR', folder):
+            first = call_api('https://test.osf.io/nodes/', pat='pat').read()
+            second = call_api('https://test.osf.io/nodes/', pat='pat').read()
+            # Only the cached response is left, not its temporary file
+            cached_files = os.listdir(folder)
+            assert len(cached_files) == 1, cached_files
+            assert not cached_files[0].endswith('.tmp'), cached_files
+
+        assert first == second == b'{"data": []}', (first, second)
+        assert not_modified.fp.closed, 'Connection for the 304 response left open'
+        request = self.mock_urlopen.call_args.args[0]
+        assert request.get_header('If-none-match') == '"v1"', request.headers
+
+    @patch('urllib.request.Request')
+    def test_call_api_handle_429_errors(self, mock_request_class):
         # Mock Request instances to check headers
-        # Mock urlopen to avoid real HTTP calls
         mock_request_instance = MagicMock()
         mock_request_class.return_value = mock_request_instance
-        mock_urlopen.side_effect = urllib.error.HTTPError(
+        self.mock_urlopen.side_effect = urllib.error.HTTPError(
             code=429,
             msg="error",
             url="",
@@ -259,7 +591,7 @@ class TestExporter(TestCase):
         with self.assertRaises(urllib.error.HTTPError):
             # Use constant time delays instead of random for quick test
             call_api('https://test.osf.io', pat='pat', is_json=True, usetest=True)
-        assert len(mock_urlopen.call_args_list) == 5
+        assert len(self.mock_urlopen.call_args_list) == 5
 
     def test_get_public_status(self):
         mock_response = MagicMock()
@@ -271,7 +603,7 @@ class TestExporter(TestCase):
                 mock_call_api.return_value = mock_response
                 result = is_public('url')
                 mock_call_api.assert_called_once_with(
-                    'url', pat='', method='GET'
+                    'url', pat='', method='HEAD'
                 )
                 assert result == pair[1], (
                     f"Expected: {pair}"
@@ -302,27 +634,60 @@ class TestExporter(TestCase):
             'root', pat='', dryrun=True
         )
 
-        assert '/helloworld.txt.txt' == files[4][0]
-        assert '/tf1/helloworld.txt.txt' == files[1][0]
-        assert '/tf1/tf2/file.txt' == files[0][0]
-        assert '/tf1/tf2-second/secondpage.txt' == files[2][0]
-        assert '/tf1/tf2-second/thirdpage.txt' == files[3][0]
+        # Files in deeper folders come first
+        paths = [file[0] for file in files]
+        assert paths == EXPECTED_MOCK_FILE_PATHS, paths
         assert files[0][1] == "2.1", (files[0][1])
         assert isinstance(files[0][2], str)
 
+    def test_explore_file_tree_keeps_subfolders_together(self):
+        tree = {'root': ['a', 'b'], 'a': ['a1'], 'b': ['b1', 'b2'], 'a1': [], 'b1': [], 'b2': []}
+
+        def list_files(link, pat, dryrun):
+            return [(f'/{link}.txt', '0.0', link)]
+
+        with patch('osfexport.exporter._list_subfolders', lambda link, *args: tree[link]), \
+                patch('osfexport.exporter._list_files', list_files):
+            files = explore_file_tree('root', pat='', dryrun=True)
+
+        # Each folder's subfolders come right before its own files
+        paths = [file[0] for file in files]
+        assert paths == ['/a1.txt', '/a.txt', '/b1.txt', '/b2.txt', '/b.txt', '/root.txt'], (
+            paths
+        )
+
+    def test_call_api_limits_requests_in_flight(self):
+        lock = threading.Lock()
+        in_flight = [0, 0]  # Current and most requests at once
+
+        def urlopen(request):
+            with lock:
+                in_flight[0] += 1
+                in_flight[1] = max(in_flight)
+            time.sleep(0.01)
+            with lock:
+                in_flight[0] -= 1
+            return MagicMock(status=200)
+
+        self.mock_urlopen.side_effect = urlopen
+        with ThreadPoolExecutor(max_workers=API_WORKERS * 3) as executor:
+            for _ in range(API_WORKERS * 3):
+                executor.submit(call_api, 'https://test.osf.io/x', pat='')
+        assert 0 < in_flight[1] <= API_WORKERS, in_flight
+
     def test_get_latest_mock_wiki_version(self):
         link = 'wiki'
         wikis = explore_wikis(
             link, pat='', dryrun=True
             )
         assert len(wikis) == 3
-        assert 'helloworld' in wikis.keys(), (
+        assert 'helloworld' in wikis, (
             'Missing wiki IDs'
         )
-        assert 'home' in wikis.keys(), (
+        assert 'home' in wikis, (
             'Missing wiki IDs'
         )
-        assert 'anotherone' in wikis.keys(), (
+        assert 'anotherone' in wikis, (
             'Missing wiki IDs'
         )
 
@@ -359,51 +724,11 @@ class TestExporter(TestCase):
             projects[root_nodes[1]]['metadata']['id']
         )
 
-        assert projects[0]['metadata']['title'] == 'Test1', (
-            'Expected title Test1, got: ',
-            projects[0]['metadata']['title']
-        )
-        assert projects[0]['metadata']['id'] == 'x', (
-            'Expected ID x, got: ',
-            projects[0]['metadata']['id']
-        )
-        assert projects[1]['metadata']['title'] == 'Test2', (
-            'Expected title Test2, got: ',
-            projects[1]['metadata']['title']
-        )
-        assert projects[0]['metadata']['license'] == 'mynewlicense', (
-            'Expected mynewlicense, got: ',
-            projects[0]['metadata']['license']
-        )
-        assert projects[0]['metadata']['description'] == 'Test1 Description', (
-            'Expected description Test1 Description, got: ',
-            projects[0]['metadata']['description']
-        )
-        assert projects[1]['metadata']['description'] == 'Test2 Description', (
-            'Expected description Test2 Description, got: ',
-            projects[1]['description']
-        )
-        expected_date = '2000-01-01 14:18 UTC'
-        assert str(
-            projects[0]['metadata']['date_created']
-        ) == expected_date, (
-            f'Expected date_created {expected_date}, got: ',
-            projects[0]['metadata']['date_created']
-        )
-        assert str(
-            projects[0]['metadata']['date_modified']
-        ) == expected_date, (
-            f'Expected date_modified {expected_date}, got: ',
-            projects[0]['metadata']['date_modified']
-        )
-        assert projects[0]['metadata']['tags'] == 'test1, test2, test3', (
-            'Expected tags test1, test2, test3, got: ',
-            projects[0]['metadata']['tags']
-        )
-        assert projects[1]['metadata']['tags'] == 'NA', (
-            'Expected tags NA, got: ',
-            projects[1]['metadata']['tags']
-        )
+        # Compare all checked fields at once, so a failure diffs every field
+        for idx, expected_fields in EXPECTED_MOCK_METADATA.items():
+            metadata = projects[idx]['metadata']
+            actual_fields = {field: metadata.get(field) for field in expected_fields}
+            self.assertEqual(actual_fields, expected_fields, f'Project {idx}')
 
         assert projects[0]['contributors'][0][0] == 'Test User 1', (
             "Expected contributor Test User 1, got: ",
@@ -413,7 +738,7 @@ class TestExporter(TestCase):
             "Expected contributor status False, got: ",
             projects[0]['contributors'][0][1]
         )
-        link = 'https://test.osf.io/userid/'
+        link = USER_URL
         link_two = 'https://test.osf.io/userid2/'
         assert projects[0]['contributors'][0][2] == link, (
             f"Expected contributor link {link}, got: ",
@@ -432,39 +757,9 @@ class TestExporter(TestCase):
             projects[0]['contributors'][1][2]
         )
 
-        doi = projects[0]['metadata']['identifiers']
-        assert doi == '10.4-2-6-25/OSF.IO/74PAD', (
-            'Expected identifiers 10.4-2-6-25/OSF.IO/74PAD, got: ',
-            doi
-        )
-        assert projects[0]['metadata']['resource_type'] == 'Other', (
-            'Expected resource_type Other, got: ',
-            projects[0]['metadata']['resource_type']
-        )
-        assert projects[0]['metadata']['resource_lang'] == 'eng', (
-            'Expected resource_lang eng, got: ',
-            projects[0]['metadata']['resource_lang']
-        )
-        assert len(projects[0]['files']) == 5
-        assert '/helloworld.txt.txt' == projects[0]['files'][4][0], (
-            projects[0]['files'][4][0]
-        )
-        assert '/tf1/helloworld.txt.txt' == projects[0]['files'][1][0], (
-            projects[0]['files'][1][0]
-        )
-        assert '/tf1/tf2/file.txt' == projects[0]['files'][0][0], (
-            projects[0]['files'][0][0]
-        )
-        subjects = projects[0]['metadata']['subjects']
-        assert subjects == 'Education, Literature, Geography', (
-            'Expected Education, Literature, Geography, got: ',
-            subjects
-        )
+        paths = [file[0] for file in projects[0]['files']]
+        assert paths == EXPECTED_MOCK_FILE_PATHS, paths
         assert len(projects[0]['wikis']) == 3
-        assert projects[0]['metadata']['url'] == 'https://test.osf.io/x/', (
-            'Expected URL https://test.osf.io/x/, got: ',
-            projects[0]['metadata']['url']
-        )
         assert projects[1]['metadata']['url'] != 'https://test.osf.io/x/', (
             'Repeated project URL'
         )
@@ -476,16 +771,6 @@ class TestExporter(TestCase):
         assert 'a' in projects[0]['children']
         assert 'b' in projects[0]['children']
 
-        assert projects[0]['metadata']['public']
-        assert not projects[1]['metadata']['public']
-
-        assert projects[0]['metadata']['category'] == 'Methods and Measures', (
-            projects[0]['metadata']['category']
-        )
-        assert projects[1]['metadata']['category'] == 'Uncategorized', (
-            projects[1]['metadata']['category']
-        )
-
         assert projects[3]['parent'][0] == projects[2]['metadata']['title'], (
             projects[3]['parent'][0],
             f'Expected: {projects[2]['metadata']['title']}'
@@ -496,12 +781,8 @@ class TestExporter(TestCase):
         )
 
     def test_get_paginated_projects(self):
-        projects, root_nodes = get_nodes(
-            pat='',
-            dryrun=True,
-            usetest=True,
-            page_size=4
-        )
+        # Dry runs always use pages of 4 nodes
+        projects, root_nodes = mock_nodes()
         assert len(projects) == 5, (
             f'Expected 5 projects in the stub data, got {len(projects)}',
             projects
@@ -514,10 +795,7 @@ class TestExporter(TestCase):
         assert root_nodes[2] == 4
 
     def test_get_single_mock_project(self):
-        projects, roots = get_nodes(
-            pat='', dryrun=True, usetest=True,
-            project_id='x'
-        )
+        projects, roots = mock_nodes(project_id='x')
         assert len(roots) == 1, (
             roots
         )
@@ -530,17 +808,14 @@ class TestExporter(TestCase):
         )
 
     def test_use_dryrun_in_user_default_dir(self):
+        from click.testing import CliRunner
+
         cwd = os.getcwd()
-        try:
-            # Go to user's home directory in cross-platform way
-            os.chdir(os.path.expanduser("~"))
+        # Run from an empty folder outside the repo, as a user would
+        # The previous working directory is restored afterwards
+        with CliRunner().isolated_filesystem():
             projects, roots = get_nodes('', dryrun=True, usetest=True)
-        except Exception as e:
-            raise e
-        finally:
-            # Reverse state changes for reproducibility
-            os.chdir(cwd)
-            assert os.getcwd() == cwd
+        assert os.getcwd() == cwd
 
     def test_extract_project_id_from_strings(self):
         input_expected = [
@@ -552,12 +827,42 @@ class TestExporter(TestCase):
             ('https://test.osf.io/af454s/?view_only=sdghsgfdsgj&field=name', 'af454s'),
             ('https://osf.io/12ap3c/?view_only=[sdghsgfdsgj]&field=name', '12ap3c')
         ]
-        for item in input_expected:
-            result = extract_project_id(item[0])
-            assert result == item[1], (
-                f"Expected {item[1]}, got: ",
-                result
-            )
+        for value, expected in input_expected:
+            with self.subTest(value=value):
+                result = extract_project_id(value)
+                assert result == expected, (
+                    f"Expected {expected}, got: ",
+                    result
+                )
+
+    def test_package_exports_load_lazily(self):
+        import osfexport
+
+        assert osfexport.extract_project_id is extract_project_id
+        assert osfexport.write_pdf is write_pdf
+        assert set(osfexport.__all__) <= set(dir(osfexport))
+        with self.assertRaises(AttributeError):
+            osfexport.not_a_real_name
+
+        # The cli submodule is already imported here, and loading it lazily
+        # in a new interpreter mustn't replace the command either
+        assert osfexport.prompt_pat is prompt_pat
+        assert osfexport.cli is cli, osfexport.cli
+        code = (
+            'import click, osfexport; osfexport.prompt_pat; '
+            'assert isinstance(osfexport.cli, click.Group), osfexport.cli'
+        )
+        subprocess.run([sys.executable, '-c', code], check=True)
+
+        # Using the exporter alone mustn't load the PDF or CLI libraries
+        code = (
+            'import sys, osfexport, osfexport.exporter; '
+            'osfexport.extract_project_id; '
+            "heavy = ('fpdf', 'qrcode', 'mistletoe', 'click', 'osfexport.formatter'); "
+            'loaded = [name for name in heavy if name in sys.modules]; '
+            'assert not loaded, loaded'
+        )
+        subprocess.run([sys.executable, '-c', code], check=True)
 
     @patch('osfexport.exporter.call_api')
     def test_add_on_paginated_results(self, mock_get):
@@ -580,15 +885,35 @@ class TestExporter(TestCase):
             start='http://api.example.com/page1', action=add_x, x=5
         )
         assert isinstance(results, deque)
-        self.assertEqual(results.popleft(), 1+5)
-        self.assertEqual(results.popleft(), 3+5)
-        self.assertEqual(results.popleft(), 5+5)
+        self.assertEqual(list(results), [1+5, 3+5, 5+5])
 
-    def test_get_single_component_mock_project(self):
-        projects, roots = get_nodes(
-            pat='', dryrun=True, usetest=True,
-            project_id='a'
+    @patch('osfexport.exporter.call_api')
+    def test_paginate_json_result_prefetches_next_page(self, mock_get):
+        page1 = {'data': 1, 'links': {'next': 'http://api.example.com/page2'}}
+        page2 = {'data': 3, 'links': {'next': None}}
+        page2_requested = threading.Event()
+
+        def get_page(link, *args, **kwargs):
+            if link.endswith('page2'):
+                page2_requested.set()
+                return page2
+            return page1
+
+        def wait_for_next_page(json, **kwargs):
+            # The next page should be requested while this one is handled
+            if json is page1:
+                assert page2_requested.wait(timeout=5), 'Next page not requested'
+            return json['data']
+
+        mock_get.side_effect = get_page
+        results = paginate_json_result(
+            start='http://api.example.com/page1', action=wait_for_next_page
         )
+        self.assertEqual(list(results), [1, 3])
+        assert mock_get.call_count == 2, mock_get.call_args_list
+
+    def test_get_single_component_mock_project(self):
+        projects, roots = mock_nodes(project_id='a')
         assert len(roots) == 1, (
             roots
         )
@@ -609,302 +934,309 @@ class TestExporter(TestCase):
 class TestFormatter(TestCase):
     """Tests for the PDF formatter."""
 
+    def setUp(self):
+        # Put PDFs in a fresh folder per test to keep things tidy
+        self.tmp = tempfile.TemporaryDirectory()
+        self.folder = self.tmp.name
+        self.addCleanup(self.tmp.cleanup)
+
+        # Work from the folder too, so PDFs written to the current directory
+        # don't clash between tests run in parallel
+        cwd = os.getcwd()
+        os.chdir(self.folder)
+        self.addCleanup(os.chdir, cwd)
+
+        self._pdf_readers = {}
+        self._pdf_text_cache = {}
+
+    def _pdf(self, path, pdf=None):
+        """Open a PDF for reading, reusing the reader if already opened.
+
+        If the PDF object from write_pdf is given, its bytes are read
+        from memory instead of opening the file again.
+        """
+
+        from pypdf import PdfReader
+
+        if path not in self._pdf_readers:
+            source = io.BytesIO(pdf.output()) if pdf is not None else path
+            self._pdf_readers[path] = PdfReader(source, strict=False)
+        return self._pdf_readers[path]
+
+    def _page_text(self, path, idx, mode='plain'):
+        """Get text from a PDF page, only extracting it on first use.
+
+        Parameters
+        -----------
+            path: str
+                Path to the PDF file.
+            idx: int
+                Index of the page to get text from.
+            mode: str
+                pypdf extraction mode. Layout mode is slower, so only use it
+                for checks that depend on spacing (e.g. tables).
+        """
+
+        key = (path, idx, mode)
+        if key not in self._pdf_text_cache:
+            page = self._pdf(path).pages[idx]
+            self._pdf_text_cache[key] = page.extract_text(extraction_mode=mode)
+        return self._pdf_text_cache[key]
+
     def test_write_pdf_no_folder_given(self):
-        projects = [
-            {
-                'metadata': {
-                    'title': 'My Project Title',
-                    'id': 'id',
-                    'url': 'https://test.osf.io/x',
-                    'category': 'Uncategorized',
-                    'description': 'This is a description of the project',
-                    'date_created': datetime.datetime.fromisoformat(
-                        '2025-06-12T15:54:42.105112Z'
-                    ),
-                    'date_modified': datetime.datetime.fromisoformat(
-                        '2001-01-01T01:01:01.105112Z'
-                    ),
-                    'tags': 'tag1, tag2, tag3',
-                    'resource_type': 'na',
-                    'resource_lang': 'english',
-                    'affiliated_institutions': 'University of Manchester',
-                    'identifiers': 'N/A',
-                    'license': 'Apache 2.0',
-                    'subjects': 'sub1, sub2, sub3',
-                },
-                'contributors': [
-                    ('Pineapple Pizza', False, 'https://test.osf.io/userid/'),
-                    ('Margarita', True, 'https://test.osf.io/userid/'),
-                    ('Margarine', True, 'https://test.osf.io/userid/')
-                ],
-                'files': [
-                    ('file1.txt', None, 'https://test.osf.io/userid/'),
-                    ('file2.txt', None, None),
-                ],
-                'funders': [],
-                'wikis': {
-                    'Home': 'hello world',
-                    'Page2': 'another page'
-                },
-                "parent": None,
-                'children': ['a']
-            }
-        ]
+        projects = [make_test_project('My Project Title')]
         root_nodes = [0]
-        is_filename_match = False  # Flag for if exported PDF has expected name
-        try:
-            pdf_one, path_one = write_pdf(projects, root_nodes[0], '')
-
-            title_one = projects[0]['metadata']['title'].replace(' ', '-')
-            date_one = pdf_one.date_printed.strftime(
-                '%Y-%m-%d %H-%M-%S %Z'
-            ).replace(' ', '-')
-            expected_filename = f'{title_one}-{date_one}.pdf'
-
-            is_filename_match = expected_filename in os.listdir(os.getcwd())
-            assert 'Component of:' not in PdfReader(path_one).pages[0].extract_text(), (
-                'Did not expect parent URL in PDF, got: ',
-                PdfReader(path_one).pages[0].extract_text()
-            )
-        except Exception as e:
-            if isinstance(e, AssertionError):
-                raise e
-        finally:
-            if os.path.exists(path_one):
-                os.remove(path_one)
+        # The test's temporary folder is removed afterwards, with the PDF
+        pdf_one, path_one = write_pdf(projects, root_nodes[0], '')
+
+        title_one = projects[0]['metadata']['title'].replace(' ', '-')
+        date_one = pdf_one.date_printed.strftime('%Y-%m-%d-%H-%M-%S-%Z')
+        expected_filename = f'{title_one}-{date_one}.pdf'
+
+        is_filename_match = (
+            os.path.basename(path_one) == expected_filename
+            and os.path.isfile(expected_filename)
+        )
+        self._pdf(path_one, pdf_one)
+        text = self._page_text(path_one, 0)
+        assert 'Component of:' not in text, (
+            'Did not expect parent URL in PDF, got: ', text
+        )
 
         assert is_filename_match, (
             'Unable to create file in current directory.'
         )
 
     def test_write_component_pdf_with_one_off_parent(self):
+        parent_title, parent_url = 'apple', 'https://test.osf.io/parent-id'
         projects = [
-            {
-                'metadata': {
-                    'title': 'Component1',
-                    'id': 'id',
-                    'url': 'https://test.osf.io/x',
-                    'category': 'Uncategorized',
-                    'description': 'This is a description of the project',
-                    'date_created': datetime.datetime.fromisoformat(
-                        '2025-06-12T15:54:42.105112Z'
-                    ),
-                    'date_modified': datetime.datetime.fromisoformat(
-                        '2001-01-01T01:01:01.105112Z'
-                    ),
-                    'tags': 'tag1, tag2, tag3',
-                    'resource_type': 'na',
-                    'resource_lang': 'english',
-                    'affiliated_institutions': 'University of Manchester',
-                    'identifiers': 'N/A',
-                    'license': 'Apache 2.0',
-                    'subjects': 'sub1, sub2, sub3',
-                },
-                'contributors': [
-                    ('Pineapple Pizza', False, 'https://test.osf.io/userid/'),
-                    ('Margarita', True, 'https://test.osf.io/userid/'),
-                    ('Margarine', True, 'https://test.osf.io/userid/')
-                ],
-                'files': [
-                    ('file1.txt', None, 'https://test.osf.io/userid/'),
-                    ('file2.txt', None, None),
-                ],
-                'funders': [],
-                'wikis': {
-                    'Home': 'hello world',
-                    'Page2': 'another page'
-                },
-                "parent": ['apple', 'https://test.osf.io/parent-id'],
-                'children': ['a']
-            }
+            make_test_project('Component1', parent=[parent_title, parent_url])
         ]
         root_nodes = [0]
-        is_filename_match = False  # Flag for if exported PDF has expected name
-        try:
-            pdf_one, path_one = write_pdf(projects, root_nodes[0], '')
+        # The test's temporary folder is removed afterwards, with the PDF
+        pdf_one, path_one = write_pdf(projects, root_nodes[0], '')
 
-            title_one = projects[0]['metadata']['title'].replace(' ', '-')
-            date_one = pdf_one.date_printed.strftime(
-                '%Y-%m-%d %H-%M-%S %Z'
-            ).replace(' ', '-')
-            expected_filename = f'{title_one}-{date_one}.pdf'
+        title_one = projects[0]['metadata']['title'].replace(' ', '-')
+        date_one = pdf_one.date_printed.strftime('%Y-%m-%d-%H-%M-%S-%Z')
+        expected_filename = f'{title_one}-{date_one}.pdf'
 
-            is_filename_match = expected_filename in os.listdir(os.getcwd())
+        is_filename_match = (
+            os.path.basename(path_one) == expected_filename
+            and os.path.isfile(expected_filename)
+        )
 
-            page_one = PdfReader(path_one)
-            text = page_one.pages[0].extract_text()
-            assert f'Parent: {projects[0]['parent'][0]}' in text, (
-                text
-            )
-            assert f'{projects[0]['parent'][1]}' in text, (
-                text
-            )
-        except Exception as e:
-            if isinstance(e, AssertionError):
-                raise e
-        finally:
-            if os.path.exists(path_one):
-                os.remove(path_one)
+        self._pdf(path_one, pdf_one)
+        text = self._page_text(path_one, 0)
+        assert f'Parent: {parent_title}' in text, text
+        assert parent_url in text, text
 
         assert is_filename_match, (
             'Unable to create file in current directory.'
         )
 
-    def test_write_unicode_pdfs_from_mock_projects(self):
-        # Put PDFs in a folder to keep things tidy
-        if os.path.exists(FOLDER_OUT):
-            shutil.rmtree(FOLDER_OUT)
-        os.mkdir(FOLDER_OUT)
+    def test_unbalanced_markdown_in_field_stays_in_field(self):
+        def count_underlines(fields):
+            pdf = PDF()
+            pdf.set_compression(False)
+            pdf.add_page()
+            pdf.set_font(pdf.font, size=PDF.FONT_SIZES['h4'])
+            pdf._write_fields(fields)
+            # Underlines are drawn as filled rectangles
+            return pdf.pages[1].contents.count(b' re f')
+
+        # '--' starts an underline that the value never closes
+        description = ('description', '2019--2020')
+        with_next_field = count_underlines([description, ('category', 'Methods')])
+        assert with_next_field == count_underlines([description]), (
+            'Underline carried on into the next field'
+        )
+
+    def test_pdfs_in_one_process_embed_own_fonts(self):
+        from pypdf import PdfReader
+
+        # Fonts are parsed once, so check later PDFs don't share
+        # (or lose) characters written to earlier ones
+        texts = ['Alpha ♡ beta', 'Zeta ✓ omega', 'Alpha ♡ beta']
+        subset_chars = []
+        for text in texts:
+            pdf = PDF()
+            pdf.add_page()
+            pdf.set_font(pdf.font, size=PDF.FONT_SIZES['h4'])
+            pdf.multi_cell(w=PDF.CELL_WIDTH, text=text)
+            page_text = PdfReader(io.BytesIO(pdf.output())).pages[0].extract_text()
+            assert text in page_text, (text, page_text)
+            subset = pdf.fonts[pdf.font].subset
+            subset_chars.append(
+                {chr(code) for glyph, _ in subset.items() for code in glyph.unicode}
+            )
+        # 'Z' is only written to the second PDF
+        assert 'Z' in subset_chars[1], subset_chars[1]
+        assert 'Z' not in subset_chars[2], subset_chars[2]
 
-        projects = [
-            {
-                'metadata': {
-                    'title': 'My Project Title',
-                    'id': 'id',
-                    'url': 'https://test.osf.io/x',
-                    'category': 'Uncategorized',
-                    'description': 'This is a description of the project ג',
-                    'date_created': datetime.datetime.fromisoformat(
-                        '2025-06-12T15:54:42.105112Z'
-                    ),
-                    'date_modified': datetime.datetime.fromisoformat(
-                        '2001-01-01T01:01:01.105112Z'
-                    ),
-                    'tags': 'tag1, tag2, tag3',
-                    'resource_type': 'na',
-                    'resource_lang': 'english',
-                    # Below uses em-dash at end
-                    'affiliated_institutions': 'University of Manchester — Test',
-                    'identifiers': 'N/A',
-                    'license': 'Apache 2.0',
-                    'subjects': 'sub1, sub2, sub3',
-                },
-                'contributors': [
-                    ('Pineapple Pizza', False, 'https://test.osf.io/userid/'),
-                    ('Margarita', True, 'https://test.osf.io/userid/'),
-                    ('Margarine', True, 'https://test.osf.io/userid/')
-                ],
-                'files': [
-                    ('file1.txt', None, 'https://test.osf.io/userid/'),
-                    ('file2.txt', None, None),
-                ],
-                'funders': [],
-                'wikis': {
-                    'Home': 'hello world',
-                    'Page2': 'another page'
-                },
-                "parent": None,
-                'children': ['a']
-            },
-            {
-                'metadata': {
-                    "title": "child1",
-                    "id": "a",
-                    'url': 'https://test.osf.io/a',
-                },
-                'contributors': [
-                    (
-                        'Long Double-Barrelled Name and Surname',
-                        False, 'https://test.osf.io/userid/'
-                    ),
-                    (
-                        'name2', True, 'https://test.osf.io/userid/'
-                    ),
-                    (
-                        'name3', True, 'https://test.osf.io/userid/'
-                    )
-                ],
-                'files': [
-                    ('file1.txt', None, None),
-                    ('file2.txt', None, None),
-                ],
-                'wikis': {},
-                "parent": ('My Project Title', 'https://test.osf.io/x'),
-                'children': ['b']
-            },
-            {
-                'metadata': {
-                    "title": "Second Project in new PDF ♡",
-                    "id": "c",
-                    'url': 'lol',
-                    'category': 'Methods and Measures'
-                },
-                'contributors': [
-                    (
-                        'Long Double-Barrelled Name and Surname',
-                        False, 'https://test.osf.io/userid/'
-                    ),
-                    (
-                        'name2', True, 'https://test.osf.io/userid/'
-                    ),
-                    (
-                        'name3', True, 'https://test.osf.io/userid/'
-                    )
-                ],
-                'files': [
-                    ('file1.txt', None, None),
-                    ('file2.txt', None, None),
-                ],
-                'wikis': {},
-                "parent": None,
-                'children': []
-            },
-            {
-                'metadata': {
-                    "title": "child2",
-                    "id": "b",
-                    'url': 'dan'
-                },
-                'contributors': [
-                    (
-                        'Long Double-Barrelled Name and Surname',
-                        False, 'https://test.osf.io/userid/'
-                    ),
-                    (
-                        'name2', True, 'https://test.osf.io/userid/'
-                    ),
-                    (
-                        'name3', True, 'https://test.osf.io/userid/'
-                    )
-                ],
-                'files': [
-                    ('file1.txt', None, None),
-                    ('file2.txt', None, None),
-                ],
-                'wikis': {},
-                "parent": ['child1', 'https://test.osf.io/a'],
-                'children': []
-            },
+    def test_write_pdfs_with_text_shaping(self):
+        try:
+            import uharfbuzz  # noqa: F401
+        except ImportError:
+            self.skipTest('uharfbuzz is needed for text shaping')
+        from pypdf import PdfReader
+
+        # Fonts are shared between PDFs, so shape text in more than one
+        for text in ('hello', 'world'):
+            pdf = PDF()
+            pdf.set_text_shaping(True)
+            pdf.add_page()
+            pdf.set_font(pdf.font, size=PDF.FONT_SIZES['h4'])
+            pdf.multi_cell(w=PDF.CELL_WIDTH, text=text)
+            page_text = PdfReader(io.BytesIO(pdf.output())).pages[0].extract_text()
+            assert text in page_text, (text, page_text)
+
+    def test_qr_codes_generated_once_per_url(self):
+        render_qr_png.cache_clear()
+        pdf = PDF(url='https://test.osf.io/x')
+        with patch('qrcode.QRCode', wraps=__import__('qrcode').QRCode) as mock_make:
+            first = pdf.generate_qr_code().read()
+            second = pdf.generate_qr_code().read()
+            pdf.url = 'https://test.osf.io/y'
+            third = pdf.generate_qr_code().read()
+        assert mock_make.call_count == 2, mock_make.call_count
+        assert first == second
+        assert first != third
+
+        # Other PDFs reuse codes already made
+        with patch('qrcode.QRCode') as mock_make:
+            other = PDF(url='https://test.osf.io/x').generate_qr_code().read()
+        mock_make.assert_not_called()
+        assert other == first
+
+    @patch('osfexport.formatter.get_img_info')
+    def test_wiki_images_downloaded_once(self, mock_img_info):
+        get_image_size.cache_clear()
+        mock_img_info.return_value = {'w': 600, 'h': 100, 'data': b'image bytes'}
+        url = 'https://test.osf.io/download/img/'
+        texts = [f'![First]({url}) and ![Again]( <{url}> )', f'![Other]({url}2)']
+
+        prefetch_wiki_images(texts)
+        assert mock_img_info.call_count == 2, mock_img_info.call_args_list
+        # Only sizes are kept, not the image data
+        assert get_image_size(url) == (600, 100), get_image_size(url)
+
+        # Rendering uses the sizes already found
+        html = markdown(texts[0], renderer=HTMLImageSizeCapRenderer)
+        assert mock_img_info.call_count == 2, mock_img_info.call_args_list
+        assert 'width="300" height="100"' in html, html
+
+    @patch('osfexport.formatter.get_img_info')
+    def test_write_image_html_with_new_size(self, mock_img_info):
+        url = 'https://osf.io/download/x/'
+        text = f"""This has an image in the wiki page.
+![Someone taking a pic on their phone camera][1]This is an image above this text.
+Another paragraph.
+
+  [1]: {url}"""
+
+        # Parse once, then render with each kind of download error
+        with HTMLImageSizeCapRenderer():
+            doc = Document(text)
+
+        # Clear cached image sizes so each error is actually hit
+        errors = [
+            urllib.error.HTTPError(
+                url=url, code=401, msg='Unauthorized', hdrs={}, fp=None
+            ),
+            PIL.UnidentifiedImageError()
         ]
+        for error in errors:
+            with self.subTest(error=type(error).__name__):
+                get_image_size.cache_clear()
+                mock_img_info.side_effect = error
+                with HTMLImageSizeCapRenderer() as renderer:
+                    html = renderer.render(doc)
+                assert f'<a href="{url}">{url}</a>' in html, (
+                    f'<a href="{url}">{url}</a>',
+                    html
+                )
+
+        # Images that can be read are shrunk to fit
+        get_image_size.cache_clear()
+        mock_img_info.side_effect = None
+        mock_img_info.return_value = {'w': 600, 'h': 100}
+        with HTMLImageSizeCapRenderer() as renderer:
+            html = renderer.render(doc)
+        assert 'width="300" height="100"' in html, html
+
+    def test_write_pdf_in_new_folder(self):
+        # Use a folder that doesn't exist yet inside the temporary folder
+        # instead of generating a random folder name
+        folder = os.path.join(self.folder, 'new-folder')
+
+        pdf, path = write_pdf(UNICODE_PROJECTS, 2, folder)
+        assert os.path.dirname(path) == folder, (path, folder)
+        assert os.path.isfile(path), path
+
+    def test_write_pdf_with_unsafe_title(self):
+        projects = copy.deepcopy(UNICODE_PROJECTS)
+        projects[2]['metadata']['title'] = 'Data/Code: v1?'
+
+        pdf, path = write_pdf(projects, 2, self.folder)
+        assert os.path.dirname(path) == os.path.join(os.getcwd(), self.folder), path
+        assert os.path.basename(path).startswith('Data-Code--v1--'), path
+        assert os.path.isfile(path), path
+
+    def test_write_pdfs_in_root_order(self):
+        titles = [project['metadata']['title'] for project in UNICODE_PROJECTS]
+        # One root is written in this process, more use worker processes.
+        # Roots are given out of order, to check paths follow the order given
+        for root_nodes in ([2], [2, 0]):
+            with self.subTest(root_nodes=root_nodes):
+                paths = list(write_pdfs(UNICODE_PROJECTS, root_nodes, self.folder))
+                assert len(paths) == len(root_nodes), paths
+                for idx, path in zip(root_nodes, paths):
+                    assert os.path.basename(path).startswith(
+                        titles[idx].replace(' ', '-')
+                    ), (titles[idx], path)
+                    assert os.path.isfile(path), path
+
+    def test_write_pdfs_raises_worker_http_errors(self):
+        # HTTPError can't be sent back from worker processes as is
+        with patch('osfexport.formatter.write_pdf', side_effect=HTTP_401):
+            _init_pdf_worker(UNICODE_PROJECTS)
+            self.addCleanup(_init_pdf_worker, [])
+            with self.assertRaises(_WorkerHTTPError) as context:
+                _write_worker_pdf(0, self.folder)
+        sent = pickle.loads(pickle.dumps(context.exception))
+
+        # The main process gets the original error type back
+        with patch('osfexport.formatter.ProcessPoolExecutor', ThreadPoolExecutor), \
+                patch('osfexport.formatter._write_worker_pdf', side_effect=sent):
+            with self.assertRaises(urllib.error.HTTPError) as context:
+                list(write_pdfs(UNICODE_PROJECTS, [0, 2], self.folder))
+        assert context.exception.code == 401, context.exception
+
+    def test_write_unicode_pdfs_from_mock_projects(self):
+        # Writing PDFs shouldn't change the projects, so no copy is needed
+        projects = UNICODE_PROJECTS
 
         root_nodes = [0, 2]  # Indices of root nodes in projects list
 
-        # Get URL now as it will be removed later
+        title = projects[0]['metadata']['title']
+        title_comp = projects[1]['metadata']['title']
         url = projects[0]['metadata']['url']
         url_comp = projects[1]['metadata']['url']
 
         # Can we specify where to write PDFs?
-        pdf_one, path_one = write_pdf(projects, root_nodes[0], FOLDER_OUT)
-        pdf_two, path_two = write_pdf(projects, root_nodes[1], FOLDER_OUT)
-        files = os.listdir(FOLDER_OUT)
-        assert len(files) == 2
+        pdf_one, path_one = write_pdf(projects, root_nodes[0], self.folder)
+        pdf_two, path_two = write_pdf(projects, root_nodes[1], self.folder)
+        assert projects[0]['metadata']['url'] == url, projects[0]['metadata']
+        self.assertTrue(os.path.isfile(path_one))
+        self.assertTrue(os.path.isfile(path_two))
 
-        title_one = projects[0]['metadata']['title'].replace(' ', '-')
+        title_one = title.replace(' ', '-')
         title_two = projects[2]['metadata']['title'].replace(' ', '-')
-        date_one = pdf_one.date_printed.strftime(
-            '%Y-%m-%d %H-%M-%S %Z'
-        ).replace(' ', '-')
-        date_two = pdf_two.date_printed.strftime(
-            '%Y-%m-%d %H-%M-%S %Z'
-        ).replace(' ', '-')
-        path_one_real = os.path.join(
-            os.getcwd(), FOLDER_OUT,
-            f'{title_one}-{date_one}.pdf'
-        )
-        path_two_real = os.path.join(
-            os.getcwd(), FOLDER_OUT,
-            f'{title_two}-{date_two}.pdf'
-        )
+        date_one = pdf_one.date_printed.strftime('%Y-%m-%d-%H-%M-%S-%Z')
+        date_two = pdf_two.date_printed.strftime('%Y-%m-%d-%H-%M-%S-%Z')
+        folder = os.path.join(os.getcwd(), self.folder)
+        path_one_real = os.path.join(folder, f'{title_one}-{date_one}.pdf')
+        path_two_real = os.path.join(folder, f'{title_two}-{date_two}.pdf')
         assert path_one == path_one_real, (
             path_one,
             path_one_real
@@ -914,44 +1246,36 @@ class TestFormatter(TestCase):
             path_two_real
         )
 
-        import_one = PdfReader(os.path.join(
-            FOLDER_OUT, f'{title_one}-{date_one}.pdf'
-        ))
-        import_two = PdfReader(os.path.join(
-            FOLDER_OUT, f'{title_two}-{date_two}.pdf'
-        ))
-        assert len(import_one.pages) == 5, (
+        # fpdf2 keeps the bytes it wrote, so read from those not the files
+        self._pdf(path_two, pdf_two)
+        assert len(self._pdf(path_one, pdf_one).pages) == 5, (
             'Expected 5 pages in the first PDF, got: ',
-            len(import_one.pages)
+            len(self._pdf(path_one).pages)
         )
 
-        content_first_page = import_one.pages[0].extract_text(
-            extraction_mode='layout'
-        )
-        assert f'{projects[0]['metadata']['title']}' in content_first_page, (
+        # Only the first page has tables that need the slower layout mode,
+        # others just need substring checks
+        content_first_page = self._page_text(path_one, 0, mode='layout')
+        assert title in content_first_page, (
             content_first_page
         )
 
-        content_second_page = import_two.pages[0].extract_text(
-            extraction_mode='layout'
-        )
+        content_second_page = self._page_text(path_two, 0)
         assert 'Category: Methods and Measures' in content_second_page, (
             content_second_page
         )
 
-        content_third_page = import_one.pages[3].extract_text(
-            extraction_mode='layout'
-        )
-        assert f'{projects[0]['metadata']['title']}' in content_third_page, (
+        content_third_page = self._page_text(path_one, 3)
+        assert title in content_third_page, (
             content_third_page
         )
-        assert f'{url}' in content_third_page, (
+        assert url in content_third_page, (
             content_third_page
         )
-        assert f'{projects[1]['metadata']['title']}' in content_third_page
-        assert f'{url_comp}' in content_third_page
+        assert title_comp in content_third_page
+        assert url_comp in content_third_page
 
-        assert f'{url}' in content_first_page, (
+        assert url in content_first_page, (
             content_third_page
         )
         assert 'Category: Uncategorized' in content_first_page, (
@@ -964,56 +1288,24 @@ class TestFormatter(TestCase):
             content_first_page
         )
 
-        # This way of string formatting compresses line lengths used
-        # End of headers and table rows marked by \n\n
-        contributors_table = (
-            '2. Contributors\n\n'
-            'Name'
-            'Bibliographic?'
-            'Profile Link\n\n'
-            'Pineapple Pizza'
-            'No'
-            'https://test.osf.io/userid/\n\n'
-            'Margarita'
-            'Yes'
-            'https://test.osf.io/userid/\n\n'
-            'Margarine'
-            'Yes'
-            'https://test.osf.io/userid/\n\n'
-        ).replace(' ', '')
-        assert contributors_table in content_first_page.replace(' ', ''), (
+        # Table spacing depends on layout, so compare without spaces
+        first_page_no_spaces = content_first_page.replace(' ', '')
+        assert CONTRIBUTORS_TABLE in first_page_no_spaces, (
             'Table: ',
-            contributors_table,
+            CONTRIBUTORS_TABLE,
             'Actual: ',
-            content_first_page.replace(' ', '')
-        )
-
-        # This way of string formatting compresses line lengths used
-        # End of headers and table rows marked by \n\n
-        files_table = (
-            '3. Files in Main Project\n\n'
-            'OSF Storage\n\n'
-            'File Name'
-            'Size (MB)'
-            'Download Link\n\n'
-            'file1.txt'
-            'N/A'
-            'https://test.osf.io/userid/\n\n'
-            'file2.txt'
-            'N/A'
-            'N/A\n\n'
-        ).replace(' ', '')
-        assert files_table in content_first_page.replace(' ', ''), (
+            first_page_no_spaces
+        )
+
+        assert FILES_TABLE in first_page_no_spaces, (
             'Table: ',
-            files_table,
+            FILES_TABLE,
             'Actual: ',
-            content_first_page.replace(' ', '')
+            first_page_no_spaces
         )
 
-        content_fourth_page = import_one.pages[4].extract_text(
-            extraction_mode='layout'
-        )
-        assert f'{projects[0]['metadata']['title']}' not in content_fourth_page, (
+        content_fourth_page = self._page_text(path_one, 4)
+        assert title not in content_fourth_page, (
             'Incorrect parent title for component'
         )
         assert f'Parent: {projects[3]['parent'][0]}' in content_fourth_page, (
@@ -1025,12 +1317,21 @@ class TestFormatter(TestCase):
             content_fourth_page
         )
 
-        # Remove files only if all good - keep for debugging otherwise
-        if os.path.exists(FOLDER_OUT):
-            shutil.rmtree(FOLDER_OUT)
-
 
 class TestCLI(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        from click.testing import CliRunner
+
+        cls.runner = CliRunner()
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.folder = self.tmp.name
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
     @patch('osfexport.exporter.is_public', lambda x: True)
     def test_prompt_pat_if_public_project_id_given(self):
         pat = prompt_pat('x')
@@ -1052,83 +1353,80 @@ class TestCLI(TestCase):
     @patch('osfexport.cli.prompt_pat')
     @patch('osfexport.exporter.get_nodes')
     def test_export_projects_handles_http_url_errors(self, mock_func, mock_prompt):
-        # Handle errors from exporting nodes
+        # -1 stands for a URLError, e.g. no connection
         export_codes = [401, 402, 403, 404, 429, 500, -1]
-        for code in export_codes:
-            mock_prompt.return_value = '-'
-            if code != -1:
-                mock_func.side_effect = urllib.error.HTTPError(
-                    url='https://test.osf.io',
-                    code=code,
-                    msg='HTTP Error',
-                    hdrs={},
-                    fp=None
-                )
-            else:
-                mock_func.side_effect = urllib.error.URLError(
-                    reason="URL Error"
-                )
-            runner = CliRunner()
-            result = runner.invoke(
-                cli, [
-                    'projects',
-                    '--usetest'
-                ],
-                terminal_width=60
-            )
-            assert "Exporting failed as an error occurred:" in result.output, (
-                result.output
-            )
+        # Handle errors from exporting nodes, and from the is_public call
+        # when prompting for a PAT
+        for step, mock_obj in (('export', mock_func), ('prompt', mock_prompt)):
+            for code in export_codes:
+                with self.subTest(step=step, code=code):
+                    mock_prompt.return_value = '-'
+                    if code != -1:
+                        mock_obj.side_effect = urllib.error.HTTPError(
+                            url='https://test.osf.io',
+                            code=code,
+                            msg='HTTP Error',
+                            hdrs={},
+                            fp=None
+                        )
+                    else:
+                        mock_obj.side_effect = urllib.error.URLError(
+                            reason="URL Error"
+                        )
+                    result = self.runner.invoke(
+                        cli, [
+                            'projects',
+                            '--usetest'
+                        ],
+                        terminal_width=60
+                    )
+                    assert "Exporting failed as an error occurred:" in result.output, (
+                        result.output
+                    )
+
+    def test_export_cache_options_only_apply_to_one_export(self):
+        from osfexport import exporter
 
-        # Handle errors from is_public call when prompting for PAT
-        for code in export_codes:
-            if code != -1:
-                mock_prompt.side_effect = urllib.error.HTTPError(
-                    url='https://test.osf.io',
-                    code=code,
-                    msg='HTTP Error',
-                    hdrs={},
-                    fp=None
+        cache_dir = os.path.join(self.folder, 'cache')
+        for options in (['--cache-dir', cache_dir], ['--no-cache']):
+            with self.subTest(options=options), \
+                    patch('osfexport.exporter.RESPONSE_CACHE_DIR', 'default-cache'):
+                result = self.runner.invoke(
+                    cli, ['projects', '--dryrun', '--folder', self.folder, *options]
                 )
-            else:
-                mock_prompt.side_effect = urllib.error.URLError(
-                    reason="URL Error"
+                assert result.exit_code == 0, result.output
+                assert exporter.RESPONSE_CACHE_DIR == 'default-cache', (
+                    exporter.RESPONSE_CACHE_DIR
                 )
-            runner = CliRunner()
-            result = runner.invoke(
-                cli, [
-                    'projects',
-                    '--usetest'
-                ],
-                terminal_width=60
-            )
-            assert "Exporting failed as an error occurred:" in result.output, (
-                result.output
-            )
 
     def test_pull_projects_command_on_mocks(self):
         """Test generating a PDF from parsed project data.
         This assumes the JSON parsing works correctly."""
 
-        if os.path.exists(FOLDER_OUT):
-            shutil.rmtree(FOLDER_OUT)
-        os.mkdir(FOLDER_OUT)
-
-        runner = CliRunner()
-        result = runner.invoke(
+        result = self.runner.invoke(
             cli, [
                 'projects',
                 '--dryrun',
-                '--folder', FOLDER_OUT,
+                '--folder', self.folder,
                 '--url', '',
                 '--pat', ''
             ],
             terminal_width=60
         )
-        assert not result.exception, (
-            result.exc_info,
-            traceback.format_tb(result.exc_info[2])
-        )
+        # Only format the traceback if the command actually failed
+        if result.exception:
+            raise AssertionError(
+                result.exc_info, traceback.format_tb(result.exc_info[2])
+            )
 
-        if os.path.exists(FOLDER_OUT):
-            shutil.rmtree(FOLDER_OUT)
+        # Exactly one PDF is written per root project
+        projects, root_nodes = mock_nodes()
+        written = os.listdir(self.folder)
+        assert len(written) == len(root_nodes), written
+        for idx in root_nodes:
+            title = projects[idx]['metadata']['title'].replace(' ', '-')
+            matches = [name for name in written if name.startswith(f'{title}-')]
+            assert len(matches) == 1, (title, written)
+            assert os.path.join(self.folder, matches[0]) in result.output, (
+                result.output
+            )